@@ -1,5 +1,9 @@
+import heapq
 import random
+import flow_network as fn
+import instrumentation as ins
 import max_flow_increase_bfs as mf
+import target_edges as te
 
 def get_random_edge(G, edges):
     """Gets a random edge out of edges"""
@@ -64,7 +68,37 @@ def get_lowest_ev_edge(G, edges):
     
     return min_edge
 
-def distribute_budget(R, budget, edge_func, edge_select_func):
+class UndoJournal:
+    """
+    Log of (edge, attribute, old value) for changes made in place to graph G,
+    so they can be undone with rollback (or kept with commit)
+    """
+
+    def __init__(self, G):
+        self.G = G
+        self.log = []
+
+    def __len__(self):
+        return len(self.log)
+
+    def record(self, u, v, attr):
+        """Saves the current value of attr on edge (u, v) - call before changing it"""
+
+        self.log.append((u, v, attr, self.G[u][v][attr]))
+
+    def commit(self):
+        """Keeps the changes made to G"""
+
+        self.log = []
+
+    def rollback(self):
+        """Restores every recorded attribute in G to its value before the changes"""
+
+        for u, v, attr, old in reversed(self.log):
+            self.G[u][v][attr] = old
+        self.log = []
+
+def distribute_budget(R, budget, edge_func, edge_select_func, journal=None, instrumentation=None):
     """ 
     edge_func gets all possible edges to consider - can be 
     get_lowest_ev_edge, get_highest_ev_edge, 
@@ -73,22 +107,53 @@ def distribute_budget(R, budget, edge_func, edge_select_func):
     edge_select_func selects out of edges returned by edge_func - 
     can be get_guaranteed_edges or get_min_cut_edges, though get_guaranteed_edges
     should be default (it is better)
+
+    If journal is an UndoJournal on R, R is changed in place rather than
+    copied and journal.rollback() gets the original back
+
+    If instrumentation (an instrumentation.Instrumentation) is given, it
+    counts and times the run and is attached to the returned distribution
     """
-    R = R.copy()
+    instr = ins.disabled if instrumentation is None else instrumentation
+    if journal is None:
+        R = R.copy()
+    else:
+        assert journal.G is R, "journal must be on R"
     distribution = {}
+    t = instr.clock()
+    # reachability is kept up to date rather than recomputed by edge_func
+    index = te.ReachabilityIndex(R) if edge_func in te.indexed_edge_funcs else None
+    # and so is the order edge_select_func would pick edges in, if it can be
+    queue = get_edge_queue(R, index, edge_func, edge_select_func)
+    instr.add_time("update", t)
 
     while budget > 0:
-        edges = edge_func(R)
-        # terminate early if we can't increase capacity anymore (does this even happen?)
-        if len(edges) == 0:
-            return distribution, R
-        u, v = edge_select_func(R, edges)
+        t = instr.clock()
+        if queue is None:
+            edges = edge_func(R) if index is None else te.indexed_edge_funcs[edge_func](index)
+            instr.add_time("edges", t)
+            # terminate early if we can't increase capacity anymore (does this even happen?)
+            if len(edges) == 0:
+                return instr.attach(distribution), R
+            t = instr.clock()
+            u, v = edge_select_func(R, edges)
+        else:
+            if len(queue) == 0:
+                return instr.attach(distribution), R
+            u, v = queue.top()
+        instr.add_time("select", t)
+        if journal is not None:
+            journal.record(u, v, "capacity")
         R[u][v]["capacity"] += budget 
         # @audit need to change when fully implemented
-        increase = mf.apply_max_flow_increase_bfs(R, "source", "sink")
+        changed = [(u, v)]
+        t = instr.clock()
+        increase = mf.apply_max_flow_increase_dinic(R, "source", "sink", changed, journal, instr.counters)
+        instr.add_time("augment", t)
         # @audit this is a point for failure if we aren't using the guaranteed edges
         if increase == 0:
             R[u][v]["capacity"] -= budget
+            instr.iteration((u, v), 0, budget)
             continue
         if (u, v) not in distribution:
             distribution[(u, v)] = 0
@@ -96,8 +161,15 @@ def distribute_budget(R, budget, edge_func, edge_select_func):
         # cap the increase at the max flow increased
         budget -= increase
         R[u][v]["capacity"] -= budget
+        if index is not None:
+            t = instr.clock()
+            s_changed, t_changed = index.update(changed)
+            if queue is not None:
+                queue.update((u, v), s_changed, t_changed)
+            instr.add_time("update", t)
+        instr.iteration((u, v), increase, budget)
     
-    return distribution, R
+    return instr.attach(distribution), R
 
 def get_edge_and_cap_inc_by_cap(R, edges):
     """Gets the edge with the lowest capacity and the capacity of the next lowest capacity edge"""
@@ -117,7 +189,7 @@ def get_edge_and_cap_inc_by_cap(R, edges):
 
     return min_e1, min_cap2
 
-def distribute_budget_fair(R, budget, edge_func, edge_select_func):
+def distribute_budget_fair(R, budget, edge_func, edge_select_func, journal=None, instrumentation=None):
     """
     edge_func gets all possible edges to consider - can be 
     get_guaranteed_edges or get_min_cut_edges, though get_guaranteed_edges
@@ -125,27 +197,332 @@ def distribute_budget_fair(R, budget, edge_func, edge_select_func):
 
     edge_select_func selects out of edges returned by edge_func -
     can be get_edge_and_cap_inc_by_ev or get_edge_and_cap_inc_by_cap
+
+    If journal is an UndoJournal on R, R is changed in place rather than
+    copied and journal.rollback() gets the original back
+
+    instrumentation as for distribute_budget
     """
 
-    R = R.copy()
+    instr = ins.disabled if instrumentation is None else instrumentation
+    if journal is None:
+        R = R.copy()
+    else:
+        assert journal.G is R, "journal must be on R"
     distribution = {}
+    t = instr.clock()
+    # reachability is kept up to date rather than recomputed by edge_func
+    index = te.ReachabilityIndex(R) if edge_func in te.indexed_edge_funcs else None
+    # and so is the order edge_select_func would pick edges in, if it can be
+    queue = get_edge_queue(R, index, edge_func, edge_select_func)
+    instr.add_time("update", t)
 
     while budget > 0:
-        edges = edge_func(R)
-        if len(edges) == 0:
-            return distribution, R
-        (u, v), cap = edge_select_func(R, edges) 
+        t = instr.clock()
+        if queue is None:
+            edges = edge_func(R) if index is None else te.indexed_edge_funcs[edge_func](index)
+            instr.add_time("edges", t)
+            if len(edges) == 0:
+                return instr.attach(distribution), R
+            t = instr.clock()
+            (u, v), cap = edge_select_func(R, edges) 
+        else:
+            if len(queue) == 0:
+                return instr.attach(distribution), R
+            (u, v), cap = queue.top(), queue.next_key()
+        instr.add_time("select", t)
         cap_inc = min(budget, cap)
+        if journal is not None:
+            journal.record(u, v, "capacity")
         R[u][v]["capacity"] += cap_inc
         # @audit need to change when fully implemented
-        increase = mf.apply_max_flow_increase_bfs(R, "source", "sink")
+        changed = [(u, v)]
+        t = instr.clock()
+        increase = mf.apply_max_flow_increase_dinic(R, "source", "sink", changed, journal, instr.counters)
+        instr.add_time("augment", t)
         if increase == 0:
             R[u][v]["capacity"] -= cap_inc
+            instr.iteration((u, v), 0, budget)
             continue
         if (u, v) not in distribution:
             distribution[(u, v)] = 0
         distribution[(u, v)] += increase
         budget -= increase
         R[u][v]["capacity"] -= cap_inc - increase
+        if index is not None:
+            t = instr.clock()
+            s_changed, t_changed = index.update(changed)
+            if queue is not None:
+                queue.update((u, v), s_changed, t_changed)
+            instr.add_time("update", t)
+        instr.iteration((u, v), increase, budget)
     
-    return distribution, R
\ No newline at end of file
+    return instr.attach(distribution), R
+
+def is_upgradable(R, u, v):
+    """Whether the capacity of (u, v) can be increased (as for the edges of get_guaranteed_edges)"""
+
+    return u != "source" and u != "sink" and v != "sink" and v != "source" \
+        and R[u][v]["capacity"] > 0
+
+def distribute_budget_exact(R, budget):
+    """
+    Optimal alternative to distribute_budget - spends budget on the capacity
+    increases that give the largest max flow increase in one min cost flow
+    solve rather than one edge at a time
+
+    Every upgradable edge gets a parallel expansion arc of unbounded capacity
+    and unit cost, and flow is sent over the cheapest paths until the budget
+    runs out, the flow on an expansion arc is the capacity increase of its
+    edge. Unlike the greedy functions this can increase several edges along
+    one path (when no single edge increase helps)
+
+    Returns distribution, R like distribute_budget (R is not modified)
+    """
+    R = R.copy()
+    nodes = list(R)
+    index = {n: i for i, n in enumerate(nodes)}
+    indptr = [0]
+    head = []
+    tail = []
+    residual = []
+    cost = []
+    arcs = {}
+    # expansion arcs and their reverses
+    expansion = {}
+    expansion_rev = {}
+    for u, nbrs in R.adj.items():
+        i = index[u]
+        for v, attr in nbrs.items():
+            arcs[(u, v)] = len(head)
+            head.append(index[v])
+            tail.append(i)
+            residual.append(attr["capacity"] - attr["flow"])
+            cost.append(0)
+            if is_upgradable(R, u, v):
+                expansion[(u, v)] = len(head)
+                head.append(index[v])
+                tail.append(i)
+                residual.append(float("inf"))
+                cost.append(1)
+        for w in R.pred[u]:
+            if is_upgradable(R, w, u):
+                expansion_rev[(w, u)] = len(head)
+                head.append(index[w])
+                tail.append(i)
+                residual.append(0)
+                cost.append(-1)
+        indptr.append(len(head))
+
+    rev = [0] * len(head)
+    for (u, v), i in arcs.items():
+        rev[i] = arcs[(v, u)]
+    for e, i in expansion.items():
+        rev[i] = expansion_rev[e]
+        rev[expansion_rev[e]] = i
+
+    fn.min_cost_augment(indptr, head, tail, rev, residual, cost,
+                        index["source"], index["sink"], budget)
+
+    # flow on the expansion arcs is what is left on their reverses
+    distribution = {}
+    for e, i in expansion_rev.items():
+        if residual[i] > 0:
+            distribution[e] = residual[i]
+    for (u, v), i in arcs.items():
+        R[u][v]["flow"] = R[u][v]["capacity"] - residual[i] \
+            + distribution.get((u, v), 0) - distribution.get((v, u), 0)
+    for (u, v), inc in distribution.items():
+        R[u][v]["capacity"] += inc
+
+    return distribution, R
+
+def sweep_budget(R, budgets, edge_func, edge_select_func, fair=False):
+    """
+    Runs distribute_budget (or distribute_budget_fair if fair, with the
+    matching edge_select_func) once up to the largest of budgets, returning
+    {budget: (distribution, R_c)} for every budget in budgets, with the same
+    results as separate runs at each budget
+
+    Steps are split at each budget level (continuing on the same edge after
+    the level) and only the edges changed since R are snapshotted there
+    """
+    budgets = sorted(set(budgets))
+    if not budgets:
+        return {}
+    R_c = R.copy()
+    distribution = {}
+    index = te.ReachabilityIndex(R_c) if edge_func in te.indexed_edge_funcs else None
+    queue = get_edge_queue(R_c, index, edge_func, edge_select_func)
+    # edges changed since R and the snapshot of them at each budget
+    touched = set()
+    snapshots = {}
+
+    spent = 0
+    level = 0
+    # what is left of the current step when it was split at a budget level
+    step_edge = None
+    step_left = 0
+    while True:
+        # snapshot every level reached so far (a level of 0 or below is
+        # reached before the first step) before spending any more
+        while level < len(budgets) and budgets[level] <= spent:
+            snapshots[budgets[level]] = (dict(distribution),
+                                         {e: (R_c.edges[e]["capacity"], R_c.edges[e]["flow"]) for e in touched})
+            level += 1
+        if level == len(budgets):
+            break
+
+        if step_left == 0:
+            if queue is None:
+                edges = edge_func(R_c) if index is None else te.indexed_edge_funcs[edge_func](index)
+                if len(edges) == 0:
+                    break
+                if fair:
+                    step_edge, cap = edge_select_func(R_c, edges)
+                else:
+                    step_edge = edge_select_func(R_c, edges)
+            else:
+                if len(queue) == 0:
+                    break
+                step_edge = queue.top()
+                if fair:
+                    cap = queue.next_key()
+            step_left = min(budgets[-1] - spent, cap) if fair else budgets[-1] - spent
+
+        u, v = step_edge
+        inc = min(step_left, budgets[level] - spent)
+        R_c[u][v]["capacity"] += inc
+        changed = [(u, v)]
+        increase = mf.apply_max_flow_increase_dinic(R_c, "source", "sink", changed)
+        R_c[u][v]["capacity"] -= inc - increase
+        if increase == 0:
+            step_left = 0
+            continue
+        if index is not None:
+            s_changed, t_changed = index.update(changed)
+            if queue is not None:
+                queue.update((u, v), s_changed, t_changed)
+        touched.update(changed)
+
+        if (u, v) not in distribution:
+            distribution[(u, v)] = 0
+        distribution[(u, v)] += increase
+        spent += increase
+        # the step ends early if it couldn't use everything it was given
+        step_left = step_left - inc if increase == inc else 0
+
+    # budgets that couldn't be reached end with the final distribution
+    for budget in budgets[level:]:
+        snapshots[budget] = (dict(distribution),
+                             {e: (R_c.edges[e]["capacity"], R_c.edges[e]["flow"]) for e in touched})
+
+    results = {}
+    for budget, (dist, changes) in snapshots.items():
+        if budget == budgets[-1]:
+            results[budget] = (dist, R_c)
+            continue
+        R_b = R.copy()
+        for e, (capacity, flow) in changes.items():
+            R_b.edges[e]["capacity"] = capacity
+            R_b.edges[e]["flow"] = flow
+        results[budget] = (dist, R_b)
+
+    return results
+
+def slowing_prob(G, u, v):
+    return G[u][v]["slowing_prob"]
+
+def capacity(G, u, v):
+    return G[u][v]["capacity"]
+
+# edge_select_funcs that pick the edge with the best key(G, u, v) out of
+# edges, as (key, whether the highest key is best)
+edge_select_keys = {
+    get_highest_ev_edge: (ev, True),
+    get_lowest_ev_edge: (ev, False),
+    get_highest_prob_edge: (slowing_prob, True),
+    get_lowest_prob_edge: (slowing_prob, False),
+    get_edge_and_cap_inc_by_cap: (capacity, False),
+}
+
+class EdgeQueue:
+    """
+    Heap of the edges of R that pass test (from te.indexed_edge_tests) on
+    index, ordered by key (highest first if highest) with ties going to the
+    edge that comes first in R, so top() is the edge the matching
+    edge_select_func would pick out of the edge_func list
+
+    Removed or re-keyed edges are left in the heap until they reach the top
+    """
+
+    def __init__(self, R, index, test, key, highest):
+        self.R = R
+        self.index = index
+        self.test = test
+        self.key = key
+        self.sign = -1 if highest else 1
+        self.order = {e: i for i, e in enumerate(R.edges)}
+        self.entries = {}
+        for u, v in R.edges:
+            if test(index, u, v):
+                self.entries[(u, v)] = [self.sign * key(R, u, v), self.order[(u, v)], (u, v)]
+        self.heap = list(self.entries.values())
+        heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _clean(self):
+        while self.heap and self.entries.get(self.heap[0][2]) is not self.heap[0]:
+            heapq.heappop(self.heap)
+
+    def top(self):
+        """The best edge"""
+
+        self._clean()
+        return self.heap[0][2]
+
+    def next_key(self):
+        """Key of the second best edge (inf if there is only one edge)"""
+
+        self._clean()
+        top = heapq.heappop(self.heap)
+        self._clean()
+        key = self.sign * self.heap[0][0] if self.heap else float("inf")
+        heapq.heappush(self.heap, top)
+        return key
+
+    def update(self, edge, s_changed, t_changed):
+        """
+        Re-checks edge (whose capacity changed) and the edges out of s_changed
+        and into t_changed (nodes that joined or left either side, as returned
+        by index.update)
+        """
+        edges = {edge}
+        edges.update((u, v) for u in s_changed for v in self.R.succ[u])
+        edges.update((u, v) for v in t_changed for u in self.R.pred[v])
+        for u, v in edges:
+            if not self.test(self.index, u, v):
+                self.entries.pop((u, v), None)
+                continue
+            key = self.sign * self.key(self.R, u, v)
+            if (u, v) not in self.entries or self.entries[(u, v)][0] != key:
+                entry = [key, self.order[(u, v)], (u, v)]
+                self.entries[(u, v)] = entry
+                heapq.heappush(self.heap, entry)
+
+        # drop the stale entries once they outnumber the live ones
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = list(self.entries.values())
+            heapq.heapify(self.heap)
+
+def get_edge_queue(R, index, edge_func, edge_select_func):
+    """
+    EdgeQueue standing in for edge_select_func over the edges of edge_func,
+    None if it can't (no index or no key for edge_select_func)
+    """
+    if index is None or edge_select_func not in edge_select_keys:
+        return None
+    key, highest = edge_select_keys[edge_select_func]
+    return EdgeQueue(R, index, te.indexed_edge_tests[edge_func], key, highest)
@@ -0,0 +1,259 @@
+from flow_network import FlowNetwork
+from gen_graph import gen_graph_max_flow
+import algorithm as ag
+import argparse
+import json
+import max_flow_increase_bfs as mf
+import model as md
+import networkx as nx
+import numpy as np
+import platform
+import random
+import sys
+import target_edges as te
+import time
+import tracemalloc
+
+# (nodes, arcs) of the fixed seed netgen graphs, smallest first
+ladder = [(15, 35), (50, 200), (200, 1500), (1000, 8000), (3000, 30000), (10000, 60000)]
+
+strategies = [
+    (ag.distribute_budget, ag.get_lowest_ev_edge),
+    (ag.distribute_budget, ag.get_highest_ev_edge),
+    (ag.distribute_budget, ag.get_lowest_prob_edge),
+    (ag.distribute_budget, ag.get_highest_prob_edge),
+    (ag.distribute_budget, ag.get_random_edge),
+    (ag.distribute_budget_fair, ag.get_edge_and_cap_inc_by_cap),
+]
+
+def load_graph(nodes, arcs, seed, cache_dir=None):
+    """Fixed seed netgen graph with random slowing attributes (also from seed)"""
+
+    G, sources, sinks = gen_graph_max_flow(mincost=1, maxcost=1, supply=0, mincap=5, maxcap=15,
+                                           nodes=nodes, density=arcs, seed=seed, cache_dir=cache_dir)
+    random.seed(seed)
+    md.set_random_probabilistic_attrs(G)
+    return G, sources, sinks
+
+def time_func(func, setup=None, min_time=0.2, max_repeats=5):
+    """
+    Best and median time of func(*setup()) over repeats (setup isn't timed),
+    repeating until min_time has been spent or max_repeats is reached
+    """
+    times = []
+    while not times or (sum(times) < min_time and len(times) < max_repeats):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), float(np.median(times)), len(times)
+
+def time_samples(func, n, max_time):
+    """
+    Time of n calls of func, estimated from as many calls (at least 3) as fit
+    in max_time, returns it and the number of calls made
+    """
+    start = time.perf_counter()
+    calls = 0
+    while calls < n and (calls < 3 or time.perf_counter() - start < max_time):
+        func()
+        calls += 1
+    return (time.perf_counter() - start) / calls * n, calls
+
+def peak_memory(func, setup=None):
+    """
+    Peak traced python allocation (in MB) of one func(*setup()) call, and
+    what the call returned
+    """
+    args = setup() if setup is not None else ()
+    tracemalloc.start()
+    try:
+        res = func(*args)
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20, res
+    finally:
+        tracemalloc.stop()
+
+def scenario_capacities(G, network, n, seed, max_prob=None):
+    """
+    n slowing scenarios of G as capacity rows over network.edges, with the
+    slowing probabilities scaled into [0, max_prob] if given
+    """
+    capacity, slowed_capacity, prob = md.get_slowing_arrays(G, network.edges)
+    if max_prob is not None:
+        prob = prob * max_prob
+    rng = np.random.default_rng(seed)
+    return np.where(rng.random((n, len(prob))) < prob, slowed_capacity, capacity)
+
+def distribution_outcome(base_value):
+    """
+    Measure of a (distribution, R_c) result: capacity added and the max flow
+    increase over base_value (the exact distribution can add more capacity
+    than flow, a path through several upgraded edges needs each of them)
+    """
+    def measure(res):
+        dist, R_c = res
+        value = sum(R_c["source"][v]["flow"] for v in R_c["source"])
+        return {"capacity_added": sum(dist.values()), "max_flow_increase": value - base_value}
+    return measure
+
+def graph_benches(G, sources, sinks, budget):
+    """
+    (name, func, setup, samples, measure) of every benchmark on G, func
+    being one of samples calls to time if samples isn't None, and measure
+    (if not None) turning what func returns into extra result fields
+    """
+
+    base_value, R = md.get_intermediate_residual_graph(G, sources, sinks, nx.flow.preflow_push)
+    outcome = distribution_outcome(base_value)
+    edges = te.get_guaranteed_edges(R)
+    u, v = ag.get_highest_ev_edge(R, edges) if edges else next(iter(G.edges))
+
+    def bumped():
+        R_c = R.copy()
+        R_c[u][v]["capacity"] += budget
+        return R_c, "source", "sink"
+
+    benches = [
+        ("get_intermediate_residual_graph",
+         lambda: md.get_intermediate_residual_graph(G, sources, sinks, nx.flow.preflow_push), None, None, None),
+        ("apply_max_flow_increase_bfs", mf.apply_max_flow_increase_bfs, bumped, None, None),
+        ("apply_max_flow_increase_dinic", mf.apply_max_flow_increase_dinic, bumped, None, None),
+        ("get_guaranteed_edges", lambda: te.get_guaranteed_edges(R), None, None, None),
+    ]
+    # greedy strategies and the exact distribution, with the max flow
+    # increase each gets out of the budget
+    for distribute, select in strategies:
+        benches.append((distribute.__name__ + "/" + select.__name__,
+                        lambda d=distribute, s=select: d(R, budget, te.get_guaranteed_edges, s), None, None,
+                        outcome))
+    benches.append(("distribute_budget_exact", lambda: ag.distribute_budget_exact(R, budget), None, None,
+                    outcome))
+
+    # cold solves vs repairs from the base flow, for the default (heavy)
+    # slowing and for light slowing (prob < 0.05)
+    network = FlowNetwork(G, sources, sinks)
+    network.set_base()
+    for label, max_prob in [("", None), ("/light", 0.05)]:
+        rows = scenario_capacities(G, network, 25, 1, max_prob)
+        benches += [
+            ("max_flow_value/25" + label,
+             lambda rows=rows: [network.max_flow_value(r) for r in rows], None, None, None),
+            ("repair_max_flow_value/25" + label,
+             lambda rows=rows: [network.repair_max_flow_value(r) for r in rows], None, None, None),
+            ("repair_max_flow_value_always/25" + label,
+             lambda rows=rows: [network.repair_max_flow_value(r, float("inf")) for r in rows], None, None, None),
+        ]
+    benches.append(("get_probabilistic_slowing_max_flow/1000",
+                    lambda: md.get_probabilistic_slowing_max_flow(G, sources, sinks), None, 1000, None))
+    benches.append(("get_probabilistic_slowing_max_flows/1000",
+                    lambda: md.get_probabilistic_slowing_max_flows(G, sources, sinks, 1000), None, None, None))
+    return benches
+
+def run(max_arcs=None, only=None, budget=100, seed=1, samples_time=2.0, cache_dir=None, log=sys.stderr):
+    """
+    Runs every benchmark on each graph of the ladder (up to max_arcs arcs,
+    only benchmarks whose name contains only) and returns the results
+    """
+    results = []
+    for nodes, arcs in ladder:
+        if max_arcs is not None and arcs > max_arcs:
+            continue
+        G, sources, sinks = load_graph(nodes, arcs, seed, cache_dir)
+        graph = "n%d_a%d" % (nodes, arcs)
+        for name, func, setup, samples, measure in graph_benches(G, sources, sinks, budget):
+            if only is not None and only not in name:
+                continue
+            random.seed(seed)
+            if samples is None:
+                best, median, repeats = time_func(func, setup)
+            else:
+                best, repeats = time_samples(func, samples, samples_time)
+                median = best
+            random.seed(seed)
+            peak, res = peak_memory(func, setup)
+            row = {"graph": graph, "nodes": G.number_of_nodes(), "arcs": G.number_of_edges(),
+                   "bench": name, "seconds": best, "median_seconds": median,
+                   "repeats": repeats, "peak_mb": peak}
+            if measure is not None:
+                row.update(measure(res))
+            results.append(row)
+            print("%-14s %-55s %10.4fs %9.1fMB%s" % (graph, name, best, peak,
+                                                     "  +%d flow" % row["max_flow_increase"]
+                                                     if "max_flow_increase" in row else ""),
+                  file=log, flush=True)
+
+    return {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "networkx": nx.__version__,
+            "platform": platform.platform(),
+            "budget": budget,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+def compare(old, new, threshold=0.1, min_seconds=0.001):
+    """
+    Matches the results of two runs by graph and benchmark, returns
+    (graph, bench, old seconds, new seconds, ratio, regressed) for each,
+    regressed meaning slower by more than threshold (relative) and
+    min_seconds (absolute, to ignore timer noise)
+    """
+    old_times = {(r["graph"], r["bench"]): r["seconds"] for r in old["results"]}
+    rows = []
+    for r in new["results"]:
+        key = (r["graph"], r["bench"])
+        if key not in old_times:
+            continue
+        before, after = old_times[key], r["seconds"]
+        ratio = after / before if before > 0 else float("inf")
+        regressed = ratio > 1 + threshold and after - before > min_seconds
+        rows.append((r["graph"], r["bench"], before, after, ratio, regressed))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the flow, budget distribution and Monte Carlo hot paths")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and write JSON results")
+    run_parser.add_argument("-o", "--output", default="benchmark.json")
+    run_parser.add_argument("--max-arcs", type=int, help="skip ladder graphs with more arcs")
+    run_parser.add_argument("--only", help="only benchmarks whose name contains this")
+    run_parser.add_argument("--budget", type=int, default=100)
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--samples-time", type=float, default=2.0,
+                            help="seconds to spend sampling get_probabilistic_slowing_max_flow per graph")
+    run_parser.add_argument("--cache-dir", help="netgen graph cache (see gen_graph.load_netgen)")
+
+    compare_parser = commands.add_parser("compare", help="flag regressions between two result files")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="relative slowdown counted as a regression")
+    compare_parser.add_argument("--min-seconds", type=float, default=0.001,
+                                help="absolute slowdown below which differences are noise")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        res = run(args.max_arcs, args.only, args.budget, args.seed, args.samples_time, args.cache_dir)
+        with open(args.output, "w") as f:
+            json.dump(res, f, indent=1)
+        return 0
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    rows = compare(old, new, args.threshold, args.min_seconds)
+    for graph, bench, before, after, ratio, regressed in rows:
+        print("%-14s %-55s %10.4fs %10.4fs %6.2fx%s" % (graph, bench, before, after, ratio,
+                                                      "  REGRESSION" if regressed else ""))
+    regressions = sum(row[-1] for row in rows)
+    print("%d regression(s) in %d benchmarks" % (regressions, len(rows)))
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
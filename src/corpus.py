@@ -0,0 +1,103 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import fcntl
+import gen_graph as gg
+import hashlib
+import json
+import numpy as np
+import os
+import random as rand
+
+# parameters every corpus instance is indexed by
+index_params = ["seed", "nodes", "density", "mincap", "maxcap"]
+
+def load_index(directory):
+    """Index entries (dicts of parameters, problem, file and arcs) of the corpus in directory"""
+
+    path = os.path.join(directory, "index.json")
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+def _key(problem, params):
+    return problem, tuple(sorted(params.items()))
+
+def _entry_key(entry):
+    return _key(entry["problem"], {k: v for k, v in entry.items() if k not in ("problem", "file", "arcs")})
+
+def _add_to_index(directory, entry):
+    """
+    Merges entry into the index of directory, re-reading it under a lock
+    file so concurrent runs into the same directory keep each other's entries
+    """
+    path = os.path.join(directory, "index.json")
+    with open(os.path.join(directory, "index.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        index = load_index(directory)
+        if all(_entry_key(e) != _entry_key(entry) for e in index):
+            index.append(entry)
+            tmp = path + "." + str(os.getpid()) + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(index, f, indent=1)
+            os.replace(tmp, path)
+
+def _generate(directory, problem, params):
+    # load_netgen writes the DIMACS file to a temporary directory of its own
+    arrays = gg.load_netgen(problem, **params)
+    digest = hashlib.sha1(repr(_key(problem, params)).encode()).hexdigest()[:8]
+    name = "_".join([problem] + [str(params[p]) for p in index_params] + [digest]) + ".npz"
+    np.savez(os.path.join(directory, name), **arrays)
+
+    return dict(params, problem=problem, file=name, arcs=len(arrays["tail"]))
+
+def generate_corpus(directory, instances, problem="max", workers=None):
+    """
+    Generates pynetgen instances (dicts of gen_graph_max_flow/gen_graph_min_cost
+    parameters with at least seed, nodes, density, mincap and maxcap) across
+    workers processes into directory and records each in its index as soon
+    as it is generated (so an interrupted run keeps what it finished),
+    instances already in the index are not generated again
+
+    A seed of -1 (random) is replaced with a drawn seed so the index can
+    reproduce the instance
+
+    Returns the index entries of instances
+    """
+    os.makedirs(directory, exist_ok=True)
+    entries = {_entry_key(e): e for e in load_index(directory)}
+
+    params = []
+    for p in instances:
+        p = dict(p)
+        if p.get("seed", -1) == -1:
+            p["seed"] = rand.randint(1, 2 ** 31 - 2)
+        params.append(p)
+    todo = list({_key(problem, p): p for p in params if _key(problem, p) not in entries}.values())
+
+    if todo:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = {executor.submit(_generate, directory, problem, p): p for p in todo}
+            for future in as_completed(futures):
+                entry = future.result()
+                _add_to_index(directory, entry)
+                entries[_key(problem, futures[future])] = entry
+
+    return [entries[_key(problem, p)] for p in params]
+
+def load_instance(directory, entry):
+    """Graph, sources and sinks of an index entry (as gen_graph_max_flow/gen_graph_min_cost)"""
+
+    with np.load(os.path.join(directory, entry["file"])) as arrays:
+        arrays = dict(arrays)
+    if entry["problem"] == "min":
+        return gg.min_cost_graph(arrays)
+    return gg.max_flow_graph(arrays)
+
+def load_corpus(directory, problem="max", **params):
+    """
+    Yields (entry, (G, sources, sinks)) for the instances in the index of
+    directory matching problem and params (eg. nodes=200)
+    """
+    for entry in load_index(directory):
+        if entry["problem"] == problem and all(entry.get(k) == v for k, v in params.items()):
+            yield entry, load_instance(directory, entry)
@@ -0,0 +1,174 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from gen_graph import gen_graph_max_flow
+from math import sqrt
+import algorithm as ag
+import argparse
+import itertools
+import json
+import model as md
+import networkx as nx
+import numpy as np
+import os
+import random
+import smalltesting as st
+import sys
+import target_edges as te
+import time
+
+# every edge_select_func of smalltesting plus the optimal distribution
+strategies = [f.__name__ for f in st.edge_select_funcs] + ["exact"]
+
+# what identifies a cell (one graph and strategy, all budgets) and a result row
+cell_keys = ["nodes", "density", "seed", "mincap", "maxcap", "strategy", "iterations"]
+row_keys = cell_keys + ["budget"]
+
+def make_grid(nodes, density, seeds, strategies=strategies, iterations=(100,), mincap=5, maxcap=15):
+    """
+    Every combination of the parameters as cells (dicts of cell_keys), seeds
+    must be fixed (not -1) for reruns to recognise finished cells
+
+    Combinations with fewer arcs (density) than nodes are left out since
+    netgen can't generate them
+    """
+
+    return [dict(zip(cell_keys, values)) for values in
+            itertools.product(nodes, density, seeds, [mincap], [maxcap], strategies, iterations)
+            if values[1] >= values[0]]
+
+def row_key(row):
+    return tuple(row[k] for k in row_keys)
+
+def load_results(path):
+    """
+    Rows in the JSONL results store at path, a line cut short by a run dying
+    mid write is ignored
+    """
+    rows = []
+    if not os.path.exists(path):
+        return rows
+    with open(path) as f:
+        for line in f:
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return rows
+
+def _open_store(path):
+    # start on a fresh line if the last run died mid write
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            torn = f.read(1) != b"\n"
+        if torn:
+            with open(path, "a") as f:
+                f.write("\n")
+    return open(path, "a")
+
+def run_cell(cell, budgets, cache_dir=None):
+    """
+    Improvement in probabilistic max flow of the cell's strategy at each of
+    budgets, on the netgen graph (and slowing attributes) of the cell's seed
+
+    Scenarios are drawn from the seed too (common random numbers), so every
+    strategy on a graph is measured against the same original max flow and
+    improvements come with their standard error
+
+    Returns one row per budget
+    """
+    start = time.perf_counter()
+    G, sources, sinks = gen_graph_max_flow(mincost=1, maxcost=1, supply=0,
+                                           mincap=cell["mincap"], maxcap=cell["maxcap"],
+                                           nodes=cell["nodes"], density=cell["density"],
+                                           seed=cell["seed"], cache_dir=cache_dir)
+    random.seed(cell["seed"])
+    md.set_random_probabilistic_attrs(G)
+
+    iterations = cell["iterations"]
+    scenarios = np.random.default_rng(cell["seed"]).random((iterations, G.number_of_edges()))
+    original_vals = st.calc_scenario_max_flows(G, G, sources, sinks, scenarios)
+    original_max = float(original_vals.mean())
+
+    _, R = md.get_intermediate_residual_graph(G, sources, sinks, nx.flow.preflow_push)
+    if cell["strategy"] == "exact":
+        sweep = {budget: ag.distribute_budget_exact(R, budget) for budget in budgets}
+    else:
+        edge_select_func = getattr(ag, cell["strategy"])
+        sweep = ag.sweep_budget(R, budgets, te.get_guaranteed_edges, edge_select_func,
+                                fair=edge_select_func == ag.get_edge_and_cap_inc_by_cap)
+
+    rows = []
+    for budget in budgets:
+        dist, R_c = sweep[budget]
+        md.clean_residual_graph(R_c)
+        diff = st.calc_scenario_max_flows(G, R_c, sources, sinks, scenarios) - original_vals
+        rows.append(dict(cell, budget=budget,
+                         original_max_flow=original_max,
+                         new_max_flow=original_max + float(diff.mean()),
+                         improvement=float(diff.mean()),
+                         improvement_stderr=float(diff.std(ddof=1) / sqrt(iterations)) if iterations > 1 else float("inf"),
+                         edges_upgraded=len(dist),
+                         capacity_added=sum(dist.values())))
+    seconds = time.perf_counter() - start
+    for row in rows:
+        row["cell_seconds"] = seconds
+    return rows
+
+def run_grid(path, cells, budgets, workers=None, cache_dir=None, log=sys.stderr):
+    """
+    Runs the cells not yet (fully) in the results store at path across
+    workers processes, appending each cell's rows as soon as it finishes, so
+    an interrupted run picks up where it left off when called again
+
+    Returns the number of cells run
+    """
+    done = {row_key(row) for row in load_results(path)}
+    budgets = sorted(set(budgets))
+    todo = []
+    for cell in cells:
+        missing = [b for b in budgets if row_key(dict(cell, budget=b)) not in done]
+        if missing:
+            todo.append((cell, missing))
+    print("%d of %d cells to run" % (len(todo), len(cells)), file=log, flush=True)
+    if not todo:
+        return 0
+
+    with _open_store(path) as store, ProcessPoolExecutor(workers) as executor:
+        futures = {executor.submit(run_cell, cell, missing, cache_dir): cell for cell, missing in todo}
+        for i, future in enumerate(as_completed(futures), 1):
+            cell = futures[future]
+            try:
+                rows = future.result()
+            except Exception as e:
+                # leave it for the next run rather than losing the others
+                print("cell %s failed: %r" % (cell, e), file=log, flush=True)
+                continue
+            store.write("".join(json.dumps(row) + "\n" for row in rows))
+            store.flush()
+            print("[%d/%d] %s" % (i, len(todo), " ".join("%s=%s" % (k, cell[k]) for k in cell_keys)),
+                  file=log, flush=True)
+
+    return len(todo)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resumable grid of budget distribution experiments")
+    parser.add_argument("results", help="JSONL results store (appended to, done cells are skipped)")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[15])
+    parser.add_argument("--density", type=int, nargs="+", default=[35])
+    parser.add_argument("--seeds", type=int, nargs="+", default=[1])
+    parser.add_argument("--strategies", nargs="+", default=strategies, choices=strategies)
+    parser.add_argument("--budgets", type=int, nargs="+", default=list(range(10, 71, 10)))
+    parser.add_argument("--iterations", type=int, nargs="+", default=[100])
+    parser.add_argument("--mincap", type=int, default=5)
+    parser.add_argument("--maxcap", type=int, default=15)
+    parser.add_argument("--workers", type=int, help="processes (default: one per CPU)")
+    parser.add_argument("--cache-dir", help="netgen graph cache (see gen_graph.load_netgen)")
+
+    args = parser.parse_args(argv)
+    cells = make_grid(args.nodes, args.density, args.seeds, args.strategies, args.iterations,
+                      args.mincap, args.maxcap)
+    run_grid(args.results, cells, args.budgets, args.workers, args.cache_dir)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,581 @@
+import heapq
+import networkx as nx
+import numpy as np
+
+def dinic(indptr, head, tail, rev, residual, source, sink, limit=float("inf"), counters=None):
+    """
+    Dinic's blocking flow algorithm over CSR arcs (arcs of node u are
+    indptr[u]:indptr[u + 1]), augments residual (list of residual arc
+    capacities) in place and returns the flow sent from source to sink
+    (stopping once it reaches limit)
+
+    rev only needs to support rev[i] for arcs on augmenting paths
+
+    If counters is given (eg. a collections.Counter), "bfs_calls",
+    "augmenting_paths" and "edges_relaxed" (arcs scanned by the breadth
+    first searches) are added to it
+    """
+    n = len(indptr) - 1
+    # level is only valid for nodes stamped in the current phase
+    level = [0] * n
+    stamp = [0] * n
+    phase = 0
+    paths = 0
+    total = 0
+
+    while True:
+        phase += 1
+        stamp[source] = phase
+        level[source] = 0
+        queue = [source]
+        for u in queue:
+            next_level = level[u] + 1
+            for i in range(indptr[u], indptr[u + 1]):
+                v = head[i]
+                if residual[i] > 0 and stamp[v] != phase:
+                    stamp[v] = phase
+                    level[v] = next_level
+                    queue.append(v)
+        if counters is not None:
+            counters["bfs_calls"] += 1
+            counters["edges_relaxed"] += sum(indptr[u + 1] - indptr[u] for u in queue)
+        if stamp[sink] != phase:
+            if counters is not None:
+                counters["augmenting_paths"] += paths
+            return total
+
+        # blocking flow with current arc pointers
+        ptr = indptr[:]
+        path = []
+        u = source
+        while True:
+            if u == sink:
+                flow = min(min(residual[i] for i in path), limit - total)
+                for i in path:
+                    residual[i] -= flow
+                    residual[rev[i]] += flow
+                total += flow
+                paths += 1
+                if total >= limit:
+                    if counters is not None:
+                        counters["augmenting_paths"] += paths
+                    return total
+                path = []
+                u = source
+                continue
+
+            i = ptr[u]
+            end = indptr[u + 1]
+            next_level = level[u] + 1
+            while i < end:
+                v = head[i]
+                if residual[i] > 0 and stamp[v] == phase and level[v] == next_level:
+                    break
+                i += 1
+            ptr[u] = i
+
+            if i < end:
+                path.append(i)
+                u = head[i]
+            elif u == source:
+                break
+            else:
+                # dead end, remove u from the level graph and retreat
+                stamp[u] = 0
+                u = tail[path.pop()]
+                ptr[u] += 1
+
+def min_cost_augment(indptr, head, tail, rev, residual, cost, source, sink, budget):
+    """
+    Min cost flow by successive shortest (by cost) paths over the same CSR
+    arcs as dinic, sending as much flow as possible from source to sink while
+    the total cost stays within budget, returns (flow sent, cost spent)
+
+    All the shortest paths of each round are filled at once with a blocking
+    flow over the arcs of zero reduced cost
+
+    cost must be non-negative on every arc with residual capacity to begin
+    with (eg. zero cost arcs carrying a max flow plus positive cost ones), so
+    path costs never decrease and stopping at the budget is optimal
+    """
+    n = len(indptr) - 1
+    # Johnson potentials keep the reduced costs non-negative for Dijkstra
+    potential = [0] * n
+    sent = 0
+    spent = 0
+
+    while True:
+        dist = [float("inf")] * n
+        dist[source] = 0
+        heap = [(0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for i in range(indptr[u], indptr[u + 1]):
+                if residual[i] > 0:
+                    v = head[i]
+                    nd = d + cost[i] + potential[u] - potential[v]
+                    if nd < dist[v]:
+                        dist[v] = nd
+                        heapq.heappush(heap, (nd, v))
+        if dist[sink] == float("inf"):
+            return sent, spent
+
+        # nodes that are unreachable now stay unreachable
+        for u in range(n):
+            if dist[u] < float("inf"):
+                potential[u] += dist[u]
+        unit = potential[sink] - potential[source]
+        limit = (budget - spent) // unit if unit > 0 else float("inf")
+        if limit <= 0:
+            return sent, spent
+
+        admissible = [r if r > 0 and cost[i] + potential[tail[i]] == potential[head[i]] else 0
+                      for i, r in enumerate(residual)]
+        flow = dinic(indptr, head, tail, rev, admissible, source, sink, limit)
+        for i, r in enumerate(admissible):
+            if r != residual[i] and cost[i] + potential[tail[i]] == potential[head[i]]:
+                residual[i] = r
+        sent += flow
+        spent += flow * unit
+
+class FlowNetwork:
+    """
+    Multi source/sink max flow network compiled once from (G, sources, sinks)
+
+    Node ids are interned to ints and arcs are stored in CSR arrays (each edge
+    of G has a forward arc and a zero capacity reverse arc). The supersource
+    "source" and supersink "sink" are added once at compile time, so the same
+    network can be solved repeatedly with different capacities.
+
+    Capacity arrays follow the order of self.edges (ie. list(G.edges))
+    """
+
+    def __init__(self, G, sources, sinks):
+        self.nodes = list(G.nodes) + ["source", "sink"]
+        self.index = {n: i for i, n in enumerate(self.nodes)}
+        self.source = self.index["source"]
+        self.sink = self.index["sink"]
+        self.edges = list(G.edges)
+        self.capacity = np.array([G.edges[e]["capacity"] for e in self.edges])
+
+        # supersource/supersink edges have infinite capacity, sources and
+        # sinks missing from G (e.g. cleaned away) can't carry flow anyway
+        super_edges = [("source", s) for s in sources if s in G] + [(t, "sink") for t in sinks if t in G]
+        tails = [self.index[u] for u, _ in self.edges + super_edges]
+        heads = [self.index[v] for _, v in self.edges + super_edges]
+        self._compile(len(self.nodes), tails, heads, len(self.edges))
+
+    def _compile(self, n, tails, heads, edge_count):
+        """
+        Builds the CSR arcs of n nodes from the int node ids of the first
+        edge_count edges (those capacity arrays are given for) followed by
+        the supersource/supersink edges
+        """
+        # arc 2k is edge k, arc 2k + 1 is its reverse
+        arc_tail = np.empty(2 * len(tails), dtype=np.int64)
+        arc_head = np.empty(2 * len(tails), dtype=np.int64)
+        arc_tail[0::2] = arc_head[1::2] = tails
+        arc_head[0::2] = arc_tail[1::2] = heads
+
+        order = np.argsort(arc_tail, kind="stable")
+        position = np.empty_like(order)
+        position[order] = np.arange(len(order))
+
+        self.n = n
+        self.m = len(order)
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(arc_tail, minlength=self.n))))
+        self.head = arc_head[order]
+        self.tail = arc_tail[order]
+        self.rev = position[order ^ 1]
+        # CSR index of the forward arc of each edge in self.edges
+        self.edge_arc = position[0:2 * edge_count:2]
+        self.super_arc = position[2 * edge_count::2]
+
+        # plain lists are much faster to index from python than numpy arrays
+        self._indptr = self.indptr.tolist()
+        self._head = self.head.tolist()
+        self._tail = self.tail.tolist()
+        self._rev = self.rev.tolist()
+
+    def arc_capacities(self, capacities=None):
+        """Capacity of each CSR arc given capacities for self.edges"""
+
+        if capacities is None:
+            capacities = self.capacity
+        capacities = np.asarray(capacities)
+        arc_cap = np.zeros(self.m, dtype=capacities.dtype)
+        arc_cap[self.edge_arc] = capacities
+        # anything above the total edge capacity is effectively infinite
+        arc_cap[self.super_arc] = capacities.sum() + 1
+        return arc_cap
+
+    def max_flow(self, capacities=None):
+        """
+        Returns the max flow value and the flow on each edge of self.edges
+        """
+        arc_cap = self.arc_capacities(capacities)
+        residual = arc_cap.tolist()
+        max_flow_val = self._solve(residual)
+        flow = arc_cap[self.edge_arc] - np.array(residual)[self.edge_arc]
+        return max_flow_val, flow
+
+    def min_cut(self, capacities=None):
+        """
+        Returns the max flow value and a boolean mask over self.edges of the
+        edges crossing the minimum cut (the source side being the nodes still
+        reachable from the supersource in the final residual network)
+        """
+        residual = self.arc_capacities(capacities).tolist()
+        max_flow_val = self._solve(residual)
+        reachable = self._reachable(residual)
+        tails = reachable[self.tail[self.edge_arc]]
+        heads = reachable[self.head[self.edge_arc]]
+        return max_flow_val, tails & ~heads
+
+    def critical_edges(self, capacities=None):
+        """
+        Returns the max flow value, the min cut mask (as min_cut) and a mask
+        over self.edges of the edges where one more unit of capacity would
+        increase the max flow (tail reachable from the supersource and head
+        reaching the supersink in the final residual network)
+        """
+        residual = self.arc_capacities(capacities).tolist()
+        max_flow_val = self._solve(residual)
+        reachable = self._reachable(residual)
+        reaching = self._reaching_sink(residual)
+        tails = self.tail[self.edge_arc]
+        heads = self.head[self.edge_arc]
+        return max_flow_val, reachable[tails] & ~reachable[heads], reachable[tails] & reaching[heads]
+
+    def max_flow_value(self, capacities=None):
+        """Returns the max flow value with capacities set for self.edges"""
+
+        return self._solve(self.arc_capacities(capacities).tolist())
+
+    def max_flow_values(self, capacities, global_relabel_freq=4):
+        """
+        Max flow values of a K x E matrix of capacities (one scenario per row)
+
+        All K scenarios are solved in lock-step by synchronous push-relabel
+        over K x m arrays: every pulse pushes excess from all active nodes of
+        all scenarios at once, then relabels the ones left with excess, with
+        a lock-step global relabel (breadth first search from the sink) every
+        global_relabel_freq pulses. Only the preflow phase is run since that
+        already gives the max flow value
+        """
+        capacities = np.atleast_2d(capacities)
+        if len(capacities) == 0:
+            return np.zeros(0, dtype=capacities.dtype)
+        n = self.n
+        tail, head, rev, indptr = self.tail, self.head, self.rev, self.indptr
+        seg_start = indptr[tail]
+        no_arcs = indptr[:-1] == indptr[1:]
+        # reduceat needs valid indices, nodes without arcs are masked anyway
+        segments = np.minimum(indptr[:-1], self.m - 1)
+
+        residual = np.zeros((len(capacities), self.m), dtype=capacities.dtype)
+        residual[:, self.edge_arc] = capacities
+        # supersource arcs only need to carry what their node can send on
+        out_capacity = np.zeros((len(capacities), n), dtype=capacities.dtype)
+        np.add.at(out_capacity, (slice(None), tail[self.edge_arc]), capacities)
+        residual[:, self.super_arc] = np.where(tail[self.super_arc] == self.source,
+                                               out_capacity[:, head[self.super_arc]],
+                                               capacities.sum(axis=1, keepdims=True) + 1)
+
+        # initial preflow saturates the supersource arcs
+        excess = np.zeros((len(capacities), n), dtype=capacities.dtype)
+        source_arcs = np.arange(indptr[self.source], indptr[self.source + 1])
+        np.add.at(excess, (slice(None), head[source_arcs]), residual[:, source_arcs])
+        residual[:, rev[source_arcs]] += residual[:, source_arcs]
+        residual[:, source_arcs] = 0
+
+        max_flow_vals = np.zeros(len(capacities), dtype=capacities.dtype)
+        # scenarios still being solved
+        rows = np.arange(len(capacities))
+        pulse = 0
+        while True:
+            if pulse % global_relabel_freq == 0:
+                height = self._distance_to_sink(residual)
+            pulse += 1
+
+            active = (excess > 0) & (height < n)
+            active[:, [self.source, self.sink]] = False
+            unfinished = active.any(axis=1)
+            if not unfinished.all():
+                # finished scenarios are dropped from the working arrays
+                max_flow_vals[rows[~unfinished]] = excess[~unfinished, self.sink]
+                rows = rows[unfinished]
+                if len(rows) == 0:
+                    return max_flow_vals
+                residual = residual[unfinished]
+                excess = excess[unfinished]
+                height = height[unfinished]
+                active = active[unfinished]
+
+            # push phase, each active node fills its admissible arcs in order
+            downhill = height[:, tail] == height[:, head] + 1
+            available = np.where(downhill & active[:, tail], residual, 0)
+            before = np.cumsum(available, axis=1) - available
+            before -= before[:, seg_start]
+            push = np.clip(excess[:, tail] - before, 0, available)
+            # arcs are grouped by tail, so the reverse of the arcs of u carry
+            # what u receives
+            received = push[:, rev]
+            residual -= push
+            residual += received
+            excess -= np.add.reduceat(push, segments, axis=1) * ~no_arcs
+            excess += np.add.reduceat(received, segments, axis=1) * ~no_arcs
+
+            # relabel phase for nodes with excess left and no admissible arcs
+            active = (excess > 0) & (height < n)
+            active[:, [self.source, self.sink]] = False
+            admissible = (residual > 0) & downhill
+            has_admissible = np.logical_or.reduceat(admissible, segments, axis=1) & ~no_arcs
+            relabel = active & ~has_admissible
+            if relabel.any():
+                neighbour_height = np.where(residual > 0, height[:, head], n)
+                min_height = np.minimum.reduceat(neighbour_height, segments, axis=1)
+                min_height[:, no_arcs] = n
+                height = np.where(relabel, np.minimum(min_height + 1, n), height)
+
+    def _distance_to_sink(self, residual):
+        """
+        Lock-step breadth first search from the sink over the residual arcs
+        of every scenario, unreachable nodes get distance n
+        """
+        k = len(residual)
+        distance = np.full((k, self.n), self.n, dtype=np.int32)
+        distance[:, self.sink] = 0
+        frontier = np.zeros((k, self.n), dtype=bool)
+        frontier[:, self.sink] = True
+        level = 0
+        while frontier.any():
+            level += 1
+            arcs = frontier[:, self.head] & (residual > 0) & (distance[:, self.tail] == self.n)
+            scenario, arc = np.nonzero(arcs)
+            frontier = np.zeros_like(frontier)
+            frontier[scenario, self.tail[arc]] = True
+            frontier[:, self.source] = False
+            distance[frontier] = level
+
+        # the source keeps height n as in the preflow initialisation
+        distance[:, self.source] = self.n
+        return distance
+
+    def set_base(self, capacities=None, flow=None):
+        """
+        Stores a base max flow for warm started solves with
+        repair_max_flow_value, solved here unless its flow over self.edges
+        is given (e.g. from get_intermediate_residual_graph)
+        """
+        if capacities is None:
+            capacities = self.capacity
+        self.base_capacity = np.asarray(capacities)
+        arc_cap = self.arc_capacities(self.base_capacity)
+
+        if flow is None:
+            residual = arc_cap.tolist()
+            self.base_value = self._solve(residual)
+            self.base_residual = residual
+            self.base_flow = arc_cap[self.edge_arc] - np.array(residual)[self.edge_arc]
+            return
+
+        self.base_flow = np.asarray(flow)
+        arc_flow = np.zeros(self.m, dtype=arc_cap.dtype)
+        arc_flow[self.edge_arc] = self.base_flow
+        # supersource/supersink arcs carry the net outflow/inflow of their node
+        net = np.zeros(self.n, dtype=arc_cap.dtype)
+        np.add.at(net, self.tail[self.edge_arc], self.base_flow)
+        np.subtract.at(net, self.head[self.edge_arc], self.base_flow)
+        super_tail = self.tail[self.super_arc]
+        arc_flow[self.super_arc] = np.where(super_tail == self.source,
+                                            net[self.head[self.super_arc]], -net[super_tail])
+        arc_flow[self.rev[self.edge_arc]] = -arc_flow[self.edge_arc]
+        arc_flow[self.rev[self.super_arc]] = -arc_flow[self.super_arc]
+
+        self.base_value = arc_flow[self.super_arc][super_tail == self.source].sum().item()
+        self.base_residual = (arc_cap - arc_flow).tolist()
+
+    def repair_max_flow_value(self, capacities, max_excess=0.25):
+        """
+        Max flow value with capacities for self.edges, warm started from the
+        base flow (see set_base) so the work mostly depends on the edges whose
+        capacity changed
+
+        Flow above the new capacity of an edge (u, v) is rerouted from u to v
+        if possible, otherwise pushed back from u to the source and from the
+        sink to v, then the flow is re-augmented
+
+        Rerouting costs more than it saves once there is a lot of it, so if
+        the flow above the new capacities is more than max_excess times the
+        base value, it's solved from scratch with max_flow_value instead
+        (pass float("inf") to always repair)
+        """
+        capacities = np.asarray(capacities)
+        changed = np.flatnonzero(capacities != self.base_capacity)
+        if len(changed) == 0:
+            return self.base_value
+        over = self.base_flow[changed] - capacities[changed]
+        if over[over > 0].sum() > max_excess * max(self.base_value, 1):
+            return self.max_flow_value(capacities)
+
+        residual = self.base_residual[:]
+        value = self.base_value
+        # keep the infinite supersource/supersink arcs above the total capacity
+        inf_increase = capacities.sum() - self.base_capacity.sum()
+        if inf_increase > 0:
+            for i in self.super_arc.tolist():
+                residual[i] += inf_increase
+
+        excess = []
+        for i, delta in zip(self.edge_arc[changed].tolist(),
+                            (capacities[changed] - self.base_capacity[changed]).tolist()):
+            residual[i] += delta
+            if residual[i] < 0:
+                # the edge carries more flow than its new capacity
+                residual[self._rev[i]] += residual[i]
+                excess.append((self._tail[i], self._head[i], -residual[i]))
+                residual[i] = 0
+
+        for u, v, over in excess:
+            over -= self._push(residual, u, v, over)
+            if over > 0:
+                if self._push(residual, u, self.source, over) < over \
+                        or self._push(residual, self.sink, v, over) < over:
+                    # couldn't repair the flow, solve from scratch instead
+                    return self.max_flow_value(capacities)
+                value -= over
+
+        if not excess and (capacities <= self.base_capacity).all():
+            # the base flow is still feasible and the max flow can't increase
+            return value
+        return value + self._solve(residual)
+
+    def _push(self, residual, s, t, limit):
+        """
+        Pushes up to limit from s to t along shortest residual paths, returns
+        the amount pushed (only the region explored by the search is touched)
+        """
+        indptr, head, tail, rev = self._indptr, self._head, self._tail, self._rev
+        pushed = 0
+        while pushed < limit:
+            pred = {s: -1}
+            queue = [s]
+            for u in queue:
+                for i in range(indptr[u], indptr[u + 1]):
+                    v = head[i]
+                    if residual[i] > 0 and v not in pred:
+                        pred[v] = i
+                        queue.append(v)
+                if t in pred:
+                    break
+            if t not in pred:
+                break
+
+            path = []
+            v = t
+            while v != s:
+                path.append(pred[v])
+                v = tail[pred[v]]
+            flow = min(limit - pushed, min(residual[i] for i in path))
+            for i in path:
+                residual[i] -= flow
+                residual[rev[i]] += flow
+            pushed += flow
+
+        return pushed
+
+    def _solve(self, residual):
+        return dinic(self._indptr, self._head, self._tail, self._rev,
+                     residual, self.source, self.sink)
+
+    def _reachable(self, residual):
+        """Boolean array of the nodes reachable from the source in residual"""
+
+        indptr, head = self._indptr, self._head
+        reachable = [False] * self.n
+        reachable[self.source] = True
+        queue = [self.source]
+        for u in queue:
+            for i in range(indptr[u], indptr[u + 1]):
+                v = head[i]
+                if residual[i] > 0 and not reachable[v]:
+                    reachable[v] = True
+                    queue.append(v)
+        return np.array(reachable)
+
+    def _reaching_sink(self, residual):
+        """Boolean array of the nodes that can reach the sink in residual"""
+
+        indptr, head, rev = self._indptr, self._head, self._rev
+        reaching = [False] * self.n
+        reaching[self.sink] = True
+        queue = [self.sink]
+        for v in queue:
+            # arcs into v are the reverses of the arcs out of v
+            for i in range(indptr[v], indptr[v + 1]):
+                u = head[i]
+                if residual[rev[i]] > 0 and not reaching[u]:
+                    reaching[u] = True
+                    queue.append(u)
+        return np.array(reaching)
+
+class VertexFlowNetwork(FlowNetwork):
+    """
+    FlowNetwork of G with vertex capacities (the "capacity" of each node),
+    split once in int id space rather than by adding "_in"/"_out" nodes:
+    node i of G has in node i and out node i + V, edge (u, v) runs from the
+    out node of u to the in node of v and node i has an in -> out arc
+
+    Capacity arrays cover self.edges (the edges of G) followed by
+    self.vertices (the nodes of G), see split_capacities
+    """
+
+    def __init__(self, G, sources, sinks):
+        self.vertices = list(G.nodes)
+        self.vertex_index = {n: i for i, n in enumerate(self.vertices)}
+        self.edges = list(G.edges)
+        v = len(self.vertices)
+        self.source = 2 * v
+        self.sink = 2 * v + 1
+        self.edge_capacity = np.array([G.edges[e]["capacity"] for e in self.edges])
+        self.vertex_capacity = np.array([G.nodes[n]["capacity"] for n in self.vertices])
+        self.capacity = self.split_capacities()
+
+        # flows are mapped back to edges of G through these
+        self.edge_tail = np.array([self.vertex_index[u] for u, _ in self.edges], dtype=np.int64)
+        self.edge_head = np.array([self.vertex_index[w] for _, w in self.edges], dtype=np.int64)
+        ids = np.arange(v)
+        source_ids = np.array([self.vertex_index[s] for s in sources if s in G], dtype=np.int64)
+        sink_ids = np.array([self.vertex_index[t] for t in sinks if t in G], dtype=np.int64)
+
+        # edges, then vertex arcs, then supersource -> sources' in nodes and
+        # sinks' out nodes -> supersink
+        tails = np.concatenate((self.edge_tail + v, ids, np.full(len(source_ids), self.source), sink_ids + v))
+        heads = np.concatenate((self.edge_head, ids + v, source_ids, np.full(len(sink_ids), self.sink)))
+        self._compile(2 * v + 2, tails, heads, len(self.edges) + v)
+
+    def split_capacities(self, edge_capacity=None, vertex_capacity=None):
+        """Capacity array for the split network, defaulting to those of G"""
+
+        if edge_capacity is None:
+            edge_capacity = self.edge_capacity
+        if vertex_capacity is None:
+            vertex_capacity = self.vertex_capacity
+        return np.concatenate((edge_capacity, vertex_capacity))
+
+    def flow_graph(self, flow):
+        """
+        Flow graph over the nodes of G from the flow on each split network
+        edge (as returned by max_flow) - edges with flow and "flow" set, like
+        model.get_max_flow_with_v_capacity
+        """
+        flow = np.asarray(flow)[:len(self.edges)]
+        used = np.flatnonzero(flow)
+        vertices = np.array(self.vertices, dtype=object)
+        G = nx.DiGraph()
+        G.add_edges_from(zip(vertices[self.edge_tail[used]], vertices[self.edge_head[used]],
+                             ({"flow": f} for f in flow[used].tolist())))
+        return G
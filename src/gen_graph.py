@@ -1,29 +1,123 @@
 from pynetgen import netgen_generate
+import hashlib
+import mmap
 import networkx as nx
+import numpy as np
+import os
+import tempfile
 
-def gen_graph_max_flow(**kwargs):
+def read_dimacs(fname):
+    """
+    Parses a DIMACS file written by pynetgen in bulk, returns a dict of
+    arrays: tail, head, capacity and for min cost problems ("p min") cost,
+    node and supply (from the "n" lines)
+    """
+    with open(fname, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        p = data.find(b"\np ") + 1
+        problem = data[p:data.find(b"\n", p)].split()[1]
+        node_start = data.find(b"\nn ", p) + 1
+        arc_start = data.find(b"\na ", p) + 1
+
+        # everything after the first "n"/"a" line is ints once the line tags are dropped
+        arcs = np.fromstring(data[arc_start:].translate(None, b"a"), dtype=np.int64, sep=" ") \
+            if arc_start > 0 else np.zeros(0, dtype=np.int64)
+        if problem == b"min":
+            arcs = arcs.reshape(-1, 5)
+            nodes = np.fromstring(data[node_start:arc_start].translate(None, b"n"), dtype=np.int64, sep=" ") \
+                if 0 < node_start < arc_start else np.zeros(0, dtype=np.int64)
+            nodes = nodes.reshape(-1, 2)
+            return {"tail": arcs[:, 0], "head": arcs[:, 1], "capacity": arcs[:, 3], "cost": arcs[:, 4],
+                    "node": nodes[:, 0], "supply": nodes[:, 1]}
+
+    arcs = arcs.reshape(-1, 3)
+    return {"tail": arcs[:, 0], "head": arcs[:, 1], "capacity": arcs[:, 2]}
+
+def graph_from_arcs(tail, head, **attrs):
+    """
+    networkx graph of the arcs (int node ids, labelled as strings) with an
+    edge attribute for each array in attrs
+
+    Nodes and edges come in the same order as building the graph from a dict
+    of dicts filled arc by arc (a repeated arc keeps its first position and
+    its last attributes)
+    """
+    if len(tail) == 0:
+        return nx.DiGraph()
+
+    # order of each tail's first appearance
+    tails, first_tail = np.unique(tail, return_index=True)
+    tail_rank = np.empty(len(tails), dtype=np.int64)
+    tail_rank[np.argsort(first_tail)] = np.arange(len(tails))
+
+    key = tail * (int(max(tail.max(), head.max())) + 1) + head
+    _, first = np.unique(key, return_index=True)
+    _, last = np.unique(key[::-1], return_index=True)
+    last = len(key) - 1 - last
+    order = np.lexsort((first, tail_rank[np.searchsorted(tails, tail[first])]))
+    first = first[order]
+    last = last[order]
+
+    G = nx.DiGraph()
+    G.add_nodes_from(tails[np.argsort(first_tail)].astype(str).tolist())
+    names = list(attrs)
+    values = zip(*(attrs[name][last].tolist() for name in names))
+    G.add_edges_from(zip(tail[first].astype(str).tolist(), head[first].astype(str).tolist(),
+                         (dict(zip(names, v)) for v in values)))
+    return G
+
+def load_netgen(problem, cache_dir=None, **kwargs):
+    """
+    Generates a pynetgen instance and reads it back with read_dimacs
+
+    The DIMACS file goes to fname if given, otherwise to a temporary
+    directory of its own (so concurrent runs never overwrite each other's)
+
+    With cache_dir (and a fixed seed), the arrays are stored there as .npz
+    keyed on the parameters, so later calls with the same parameters load
+    them instead of generating again
+    """
+    path = None
+    if cache_dir is not None and kwargs.get("seed", 1) != -1:
+        params = sorted((k, v) for k, v in kwargs.items() if k != "fname")
+        key = hashlib.sha1(repr((problem, params)).encode()).hexdigest()[:16]
+        path = os.path.join(cache_dir, problem + "_" + key + ".npz")
+        if os.path.exists(path):
+            with np.load(path) as arrays:
+                return dict(arrays)
+
+    if "fname" in kwargs:
+        netgen_generate(**kwargs)
+        arrays = read_dimacs(kwargs["fname"])
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, "graph.net")
+            netgen_generate(fname=fname, **kwargs)
+            arrays = read_dimacs(fname)
+
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write then rename so parallel runs never read half a file
+        tmp = path + "." + str(os.getpid()) + ".tmp.npz"
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+
+    return arrays
+
+def gen_graph_max_flow(cache_dir=None, **kwargs):
     """
     Generate a random graph for a basic max flow problem and return it as a networkx graph
 
-    Check the pynetgen documentation for the available parameters
+    Check the pynetgen documentation for the available parameters, see
+    load_netgen for fname and cache_dir
     """
 
-    netgen_generate(**kwargs)
-
-    with open("test.net") as f:
-        l = f.readline()
-        while l[0] != 'a':
-            l = f.readline()
-        
-        graph = {}
-        while l:
-            _, u, v, capacity = l.split()
-            if u not in graph:
-                graph[u] = {}
-            graph[u][v] = {"capacity": int(capacity)}
-            l = f.readline()
-
-    G = nx.DiGraph(graph)
+    return max_flow_graph(load_netgen("max", cache_dir, **kwargs))
+
+def max_flow_graph(arrays):
+    """gen_graph_max_flow's graph, sources and sinks from read_dimacs arrays"""
+
+    G = graph_from_arcs(arrays["tail"], arrays["head"], capacity=arrays["capacity"])
+
     sources = []
     sinks = []
     for n in G.nodes:
@@ -31,13 +125,13 @@ def gen_graph_max_flow(**kwargs):
             sources.append(n)
         elif G.out_degree(n) == 0:
             sinks.append(n)
-    
+
     nx.set_edge_attributes(G, 0, "slowing_prob")
     nx.set_edge_attributes(G, 0, "slowing_factor")
-    
+
     return G, set(sources), set(sinks)
 
-def gen_graph_min_cost(**kwargs):
+def gen_graph_min_cost(cache_dir=None, **kwargs):
     """
     Generate a random graph for the min cost flow problem satisfying given demands
     and return it as a networkx graph
@@ -47,40 +141,29 @@ def gen_graph_min_cost(**kwargs):
 
     This could be used for testing the progress towards satisfying existing demands
     that a graph modification could make
+
+    fname and cache_dir as for gen_graph_max_flow
     """
-    netgen_generate(**kwargs)
-
-    with open("test.net") as f:
-        l = f.readline()
-        while l[0] != 'n':
-            l = f.readline()
-        
-        sources = {}
-        sinks = {}
-        while l[0] == 'n':
-            _, n, supply = l.split()
-            supply = int(supply)
-            # flip the sign since we're using demand rather than supply
-            if supply > 0:
-                sources[n] = -supply
-                # @audit how should capacity be set in relation to supply?
-            else:
-                sinks[n] = -supply
-            l = f.readline()
-        
-        graph = {}
-        while l:
-            _, u, v, _, capacity, cost = l.split()
-            if u not in graph:
-                graph[u] = {}
-            graph[u][v] = {"capacity": int(capacity), "cost": int(cost)}
-            l = f.readline()
-    
-    G = nx.DiGraph(graph)
+    return min_cost_graph(load_netgen("min", cache_dir, **kwargs))
+
+def min_cost_graph(arrays):
+    """gen_graph_min_cost's graph, sources and sinks from read_dimacs arrays"""
+
+    sources = {}
+    sinks = {}
+    for n, supply in zip(arrays["node"].astype(str).tolist(), arrays["supply"].tolist()):
+        # flip the sign since we're using demand rather than supply
+        if supply > 0:
+            sources[n] = -supply
+            # @audit how should capacity be set in relation to supply?
+        else:
+            sinks[n] = -supply
+
+    G = graph_from_arcs(arrays["tail"], arrays["head"],
+                        capacity=arrays["capacity"], cost=arrays["cost"])
     for n in sources:
         G.nodes[n]["demand"] = sources[n]
     for n in sinks:
         G.nodes[n]["demand"] = sinks[n]
-    
-    return G, set(sources), set(sinks)
 
+    return G, set(sources), set(sinks)
@@ -0,0 +1,84 @@
+from collections import Counter
+import time
+
+class Distribution(dict):
+    """Budget distribution (edge -> capacity increase) with the Instrumentation of the run that made it"""
+
+    def __init__(self, distribution, instrumentation):
+        super().__init__(distribution)
+        self.instrumentation = instrumentation
+
+class Instrumentation:
+    """
+    Opt-in counters, per phase wall times (in seconds) and per iteration
+    callbacks for distribute_budget and distribute_budget_fair
+
+    counters gets "iterations", "zero_gain" (iterations whose bump didn't
+    increase the max flow), "bfs_calls", "augmenting_paths" and
+    "edges_relaxed" (from the max flow increase), times gets "edges"
+    (edge_func), "select" (edge_select_func), "augment" (the max flow
+    increase) and "update" (reachability index upkeep) - when the edge queue
+    replaces edge_func and edge_select_func, its lookups are all "select"
+
+    Each callback is called after every iteration with a dict of iteration,
+    edge, increase, budget (left) and elapsed (seconds since the run began)
+    """
+
+    def __init__(self, callbacks=()):
+        self.counters = Counter()
+        self.times = Counter()
+        self.callbacks = list(callbacks)
+        self._start = None
+
+    def on_iteration(self, callback):
+        """Registers callback (usable as a decorator)"""
+
+        self.callbacks.append(callback)
+        return callback
+
+    def clock(self):
+        if self._start is None:
+            self._start = time.perf_counter()
+        return time.perf_counter()
+
+    def add_time(self, phase, start):
+        self.times[phase] += time.perf_counter() - start
+
+    def iteration(self, edge, increase, budget):
+        self.counters["iterations"] += 1
+        if increase == 0:
+            self.counters["zero_gain"] += 1
+        if self.callbacks:
+            info = {"iteration": self.counters["iterations"], "edge": edge, "increase": increase,
+                    "budget": budget, "elapsed": time.perf_counter() - self._start}
+            for callback in self.callbacks:
+                callback(info)
+
+    def attach(self, distribution):
+        return Distribution(distribution, self)
+
+    def summary(self):
+        """Counters and phase times in one dict"""
+
+        res = dict(self.counters)
+        res.update({phase + "_seconds": t for phase, t in self.times.items()})
+        return res
+
+class _Disabled:
+    # stands in for an Instrumentation when none is given, so the hot loops
+    # only pay for a few empty calls
+    counters = None
+
+    def clock(self):
+        return 0
+
+    def add_time(self, phase, start):
+        pass
+
+    def iteration(self, edge, increase, budget):
+        pass
+
+    def attach(self, distribution):
+        return distribution
+
+disabled = _Disabled()
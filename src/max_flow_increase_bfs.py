@@ -1,7 +1,10 @@
 import networkx as nx
 from collections import deque
+import flow_network as fn
 
-def bfs(G, source, sink, pred):
+def bfs(G, source, sink, pred, counters=None):
+    if counters is not None:
+        counters["bfs_calls"] += 1
     for n in G.nodes:
         pred[n] = -1 
     q = deque()
@@ -10,6 +13,8 @@ def bfs(G, source, sink, pred):
 
     while q:
         u, curr_flow = q.popleft()
+        if counters is not None:
+            counters["edges_relaxed"] += len(G[u])
         for v in G[u]:
             capacity = G[u][v]["capacity"]
             flow = G[u][v]["flow"]
@@ -27,11 +32,18 @@ def max_flow_increase_bfs(G, source, sink):
     return apply_max_flow_increase_bfs(G, source, sink)
 
 
-def apply_max_flow_increase_bfs(G, source, sink):
+def apply_max_flow_increase_bfs(G, source, sink, counters=None):
+    """
+    Augments the residual graph G in place along shortest paths and returns
+    the max flow increase, "bfs_calls", "augmenting_paths" and "edges_relaxed"
+    are added to counters (eg. a collections.Counter) if given
+    """
     pred = {n: -1 for n in G.nodes}
     increase = 0
-    new_flow = bfs(G, source, sink, pred)
+    new_flow = bfs(G, source, sink, pred, counters)
     while new_flow > 0:
+        if counters is not None:
+            counters["augmenting_paths"] += 1
         increase += new_flow
         v = sink
         while v != source:
@@ -39,6 +51,72 @@ def apply_max_flow_increase_bfs(G, source, sink):
             G[u][v]["flow"] += new_flow
             G[v][u]["flow"] -= new_flow
             v = u
-        new_flow = bfs(G, source, sink, pred)
+        new_flow = bfs(G, source, sink, pred, counters)
     
-    return increase
\ No newline at end of file
+    return increase
+
+class _ReverseArcs(dict):
+    """Lazily finds the reverse of arc i (only needed for augmenting paths)"""
+
+    def __init__(self, indptr, head, tail):
+        super().__init__()
+        self.indptr = indptr
+        self.head = head
+        self.tail = tail
+
+    def __missing__(self, i):
+        u = self.tail[i]
+        v = self.head[i]
+        j = self.indptr[v]
+        while self.head[j] != u:
+            j += 1
+        self[i] = j
+        return j
+
+def max_flow_increase_dinic(G, source, sink):
+    G = G.copy()
+    return apply_max_flow_increase_dinic(G, source, sink)
+
+def apply_max_flow_increase_dinic(G, source, sink, changed=None, journal=None, counters=None):
+    """
+    Same contract as apply_max_flow_increase_bfs (augments the residual graph
+    G in place and returns the max flow increase) but sends blocking flows
+    with Dinic's algorithm over node indexed arrays rather than one shortest
+    path at a time
+
+    G must contain the reverse of every edge (as in networkx residual graphs)
+
+    If changed is a list, the edges whose flow changed are appended to it,
+    old flows are recorded in journal (an algorithm.UndoJournal) if given
+    and counters are passed on to flow_network.dinic
+    """
+    nodes = list(G)
+    index = {n: i for i, n in enumerate(nodes)}
+    indptr = [0]
+    head = []
+    tail = []
+    attrs = []
+    for u, nbrs in G.adj.items():
+        i = index[u]
+        for v, attr in nbrs.items():
+            head.append(index[v])
+            tail.append(i)
+            attrs.append(attr)
+        indptr.append(len(head))
+
+    residual = [attr["capacity"] - attr["flow"] for attr in attrs]
+    start = residual[:]
+
+    increase = fn.dinic(indptr, head, tail, _ReverseArcs(indptr, head, tail),
+                        residual, index[source], index[sink], counters=counters)
+
+    if increase > 0:
+        for i, (attr, before, after) in enumerate(zip(attrs, start, residual)):
+            if before != after:
+                if journal is not None:
+                    journal.record(nodes[tail[i]], nodes[head[i]], "flow")
+                attr["flow"] += before - after
+                if changed is not None:
+                    changed.append((nodes[tail[i]], nodes[head[i]]))
+
+    return increase
@@ -1,6 +1,10 @@
+import hashlib
 import networkx as nx
+import numpy as np
 import random as rand
+from collections import OrderedDict
 from math import ceil
+from flow_network import FlowNetwork, VertexFlowNetwork
 
 ###################### Helpers ######################
 def draw(G, attribute="capacity"):
@@ -17,6 +21,19 @@ def calc_max_flow_vals(G, sinks):
 
     return max_flow_vals
 
+def get_flow_val(G, sinks):
+    """
+    Total flow into sinks of a flow graph (sinks missing from G, e.g. removed
+    or cleaned away, receive no flow)
+    """
+    flow_val = 0
+    for n in sinks:
+        if n in G:
+            flow_val += sum(attr["flow"] for _, _, attr in G.in_edges(n, data=True))
+            flow_val -= sum(attr["flow"] for _, _, attr in G.out_edges(n, data=True))
+
+    return flow_val
+
 def clean_graph(G):
     # remove edges with 0 flow
     G.remove_edges_from([e for e in G.edges if G.edges[e]["flow"] == 0])
@@ -88,6 +105,12 @@ def get_max_flow_with_v_capacity(G, sources, sinks, max_flow_func=nx.maximum_flo
     Ensure "weight" is defined in G for each edge if calculating min cost max flow.
     In this case max_flow_func=nx.max_cost_min_flow.
     """
+    if max_flow_func == nx.maximum_flow:
+        # any max flow will do, so split in int id space instead
+        network = VertexFlowNetwork(G, sources, sinks)
+        _, flow = network.max_flow()
+        return network.flow_graph(flow)
+
     aux_sources = [n + "_in" for n in sources]
     aux_sinks = [n + "_out" for n in sinks]
 
@@ -116,12 +139,14 @@ def get_max_flow_with_v_capacity(G, sources, sinks, max_flow_func=nx.maximum_flo
 
     for n in G.nodes:
         G_c.add_node(n)
-        for e in G_c.in_edges(n + "_in", data=True):
-            G_c.add_edge(e[0], n, flow=e[2]["flow"])
-        for e in G_c.out_edges(n + "_out", data=True):
-            G_c.add_edge(n, e[1], flow=e[2]["flow"])
-        G_c.remove_node(n + "_in")
-        G_c.remove_node(n + "_out")
+        # split vertices without flow have already been cleaned away
+        if n + "_in" in G_c:
+            for e in G_c.in_edges(n + "_in", data=True):
+                G_c.add_edge(e[0], n, flow=e[2]["flow"])
+        if n + "_out" in G_c:
+            for e in G_c.out_edges(n + "_out", data=True):
+                G_c.add_edge(n, e[1], flow=e[2]["flow"])
+        G_c.remove_nodes_from([n + "_in", n + "_out"])
     
     # cleanup 
     clean_graph(G_c)
@@ -203,6 +228,165 @@ def get_probabilistic_slowing_max_flow(G, sources, sinks, flow_func=get_max_flow
     
     return flow_func(G, sources, sinks)
 
+def get_rng(rng=None):
+    """
+    Returns rng if given, otherwise a numpy generator seeded from the global
+    random module (so rand.seed still makes batched sampling reproducible)
+    """
+    if rng is None:
+        rng = np.random.default_rng(rand.getrandbits(64))
+    return rng
+
+def get_slowing_arrays(G, edges=None):
+    """
+    Returns arrays (following the order of edges, defaulting to list(G.edges))
+    of capacity, capacity when slowed and slowing probability
+    """
+    if edges is None:
+        edges = list(G.edges)
+
+    capacity = np.array([G.edges[e]["capacity"] for e in edges])
+    prob = np.array([G.edges[e]["slowing_prob"] for e in edges], dtype=float)
+    factor = np.array([G.edges[e]["slowing_factor"] for e in edges], dtype=float)
+    # round up so we don't have 0 capacity if not intended
+    slowed_capacity = np.ceil(capacity * (1 - factor)).astype(capacity.dtype)
+
+    return capacity, slowed_capacity, prob
+
+def sample_slowed_capacities(G, n, edges=None, rng=None):
+    """
+    Draws n slowing scenarios at once and returns an n x E capacity matrix,
+    columns following the order of edges (defaults to list(G.edges))
+
+    Uses the same rounding rule as get_probabilistic_slowing_max_flow
+    """
+    capacity, slowed_capacity, prob = get_slowing_arrays(G, edges)
+    slowed = get_rng(rng).random((n, len(capacity))) < prob
+
+    return np.where(slowed, slowed_capacity, capacity)
+
+class ScenarioCache:
+    """
+    Bounded LRU cache of scenario max flow values keyed on the version of the
+    compiled graph (see get_graph_version) and a bitset of the scenario (eg.
+    which edges are slowed, from np.packbits), with hits and misses counts
+
+    Versions change with capacities, so a modified graph (eg. after
+    distribute_budget) never gets another version's results, invalidate
+    frees them
+
+    Holds at most maxsize entries and maxbytes of keys (counting entry_bytes
+    of bookkeeping per entry), so large graphs with long keys keep fewer
+    """
+    # rough size of an entry besides its key (dict slot, tuple, value)
+    entry_bytes = 200
+
+    def __init__(self, maxsize=100000, maxbytes=64 * 2**20):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, version, key):
+        """Cached value for key of version, None if there isn't one"""
+
+        value = self.entries.get((version, key))
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end((version, key))
+        self.hits += 1
+        return value
+
+    def put(self, version, key, value):
+        if (version, key) not in self.entries:
+            self.nbytes += len(key) + self.entry_bytes
+        self.entries[(version, key)] = value
+        self.entries.move_to_end((version, key))
+        while len(self.entries) > self.maxsize or (self.nbytes > self.maxbytes and len(self.entries) > 1):
+            (_, old), _ = self.entries.popitem(last=False)
+            self.nbytes -= len(old) + self.entry_bytes
+
+    def invalidate(self, version=None):
+        """Drops the entries of version (or every entry)"""
+
+        if version is None:
+            self.entries.clear()
+            self.nbytes = 0
+            return
+        for k in [k for k in self.entries if k[0] == version]:
+            del self.entries[k]
+            self.nbytes -= len(k[1]) + self.entry_bytes
+
+def get_graph_version(network, *arrays):
+    """
+    Version of a compiled network (FlowNetwork) together with the arrays its
+    scenarios are built from (eg. capacity and slowed capacity), a sha1
+    digest so different graphs never share cached values
+    """
+    digest = hashlib.sha1(repr(list(network.edges)).encode())
+    digest.update(np.ascontiguousarray(network.head).tobytes())
+    digest.update(np.ascontiguousarray(network.tail).tobytes())
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        # dtype and shape too, so the same bytes can't stand for other arrays
+        digest.update(repr((a.dtype.str, a.shape)).encode())
+        digest.update(a.tobytes())
+    return digest.digest()
+
+def get_probabilistic_slowing_max_flows(G, sources, sinks, n, rng=None, batch_size=None,
+                                        cache=None):
+    """
+    Batched get_probabilistic_slowing_max_flow over n scenarios
+
+    All slowdowns are drawn in one go and every scenario is solved on the same
+    compiled FlowNetwork (no per scenario graph copies). With batch_size,
+    scenarios are solved batch_size at a time in lock-step (see
+    FlowNetwork.max_flow_values), which pays off on smaller graphs. With a
+    ScenarioCache, each distinct set of slowed edges is only solved once
+    (and not at all if cached from an earlier call on the same graph), the
+    ones not in the cache being batched by batch_size as above
+
+    Returns the max flow value of each scenario and their mean
+    """
+    network = FlowNetwork(G, sources, sinks)
+
+    if cache is not None:
+        capacity, slowed_capacity, prob = get_slowing_arrays(G, network.edges)
+        version = get_graph_version(network, capacity, slowed_capacity)
+        slowed = get_rng(rng).random((n, len(prob))) < prob
+        keys, first, inverse = np.unique(np.packbits(slowed, axis=1), axis=0,
+                                         return_index=True, return_inverse=True)
+        keys = [key.tobytes() for key in keys]
+        values = [cache.get(version, key) for key in keys]
+        missing = [j for j, value in enumerate(values) if value is None]
+        capacities = np.where(slowed[first[missing]], slowed_capacity, capacity)
+        if batch_size is None:
+            solved = [network.max_flow_value(row) for row in capacities]
+        else:
+            solved = [value for i in range(0, len(missing), batch_size)
+                      for value in network.max_flow_values(capacities[i:i + batch_size])]
+        for j, value in zip(missing, solved):
+            cache.put(version, keys[j], value)
+            values[j] = value
+        max_flow_vals = np.array(values)[inverse.reshape(-1)]
+        return max_flow_vals, max_flow_vals.mean()
+
+    capacities = sample_slowed_capacities(G, n, network.edges, rng)
+
+    if batch_size is None:
+        max_flow_vals = np.array([network.max_flow_value(row) for row in capacities])
+    else:
+        max_flow_vals = np.concatenate([network.max_flow_values(capacities[i:i + batch_size])
+                                        for i in range(0, n, batch_size)])
+
+    return max_flow_vals, max_flow_vals.mean()
+
 def get_probabilistic_v_blocking_max_flow(G, sources, sinks, 
                                           base_problem_func=get_max_flow_with_v_capacity):
     """
@@ -252,14 +436,17 @@ def get_expected_max_flow(G, sources, sinks, flow_func=get_max_flow):
 
     return calc_max_flow_vals(G, sinks)
 
-def set_random_probabilistic_attrs(G, prob_range=(0, 1), factor_range=(0, 1)):
+def set_random_probabilistic_attrs(G, prob_range=(0, 1), factor_range=(0, 1), random=None):
     """
-    Sets random slowing probability and factor for each edge in G
+    Sets random slowing probability and factor for each edge in G, drawn
+    from random (a random.Random) if given, otherwise the global random module
     """
+    if random is None:
+        random = rand
 
     for u, v in G.edges:
-        G.edges[(u, v)]["slowing_prob"] = rand.uniform(*prob_range)
-        G.edges[(u, v)]["slowing_factor"] = rand.uniform(*factor_range)
+        G.edges[(u, v)]["slowing_prob"] = random.uniform(*prob_range)
+        G.edges[(u, v)]["slowing_factor"] = random.uniform(*factor_range)
 
 def get_intermediate_residual_graph(G, sources, sinks, flow_func):
     G = G.copy()
@@ -0,0 +1,611 @@
+import model as md
+import networkx as nx
+import numpy as np
+import random as rand
+from concurrent.futures import ProcessPoolExecutor
+from flow_network import FlowNetwork, VertexFlowNetwork
+from math import ceil, sqrt
+
+class RunningStats:
+    """
+    Running mean and variance of a stream of samples (Welford's algorithm)
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def add_all(self, xs):
+        for x in xs:
+            self.add(x)
+
+    def merge(self, other):
+        """Adds the samples summarised by other (Chan et al.'s pairwise update)"""
+
+        n = self.n + other.n
+        if n == 0:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+
+    @property
+    def variance(self):
+        """Unbiased sample variance"""
+
+        if self.n < 2:
+            return float("inf")
+        return self.m2 / (self.n - 1)
+
+    @property
+    def stderr(self):
+        """Standard error of the mean"""
+
+        return sqrt(self.variance / self.n) if self.n > 0 else float("inf")
+
+class ControlVariateStats:
+    """
+    Running control variate estimate from (sample, control) pairs where the
+    control has known mean control_mean, the coefficient is the least squares
+    fit of sample on control so far
+    """
+
+    def __init__(self, control_mean):
+        self.control_mean = control_mean
+        self.n = 0
+        self.mean_y = 0.0
+        self.mean_c = 0.0
+        self.m2_y = 0.0
+        self.m2_c = 0.0
+        self.c_yc = 0.0
+
+    def add(self, pair):
+        y, c = pair
+        self.n += 1
+        delta_y = y - self.mean_y
+        delta_c = c - self.mean_c
+        self.mean_y += delta_y / self.n
+        self.mean_c += delta_c / self.n
+        self.m2_y += delta_y * (y - self.mean_y)
+        self.m2_c += delta_c * (c - self.mean_c)
+        self.c_yc += delta_y * (c - self.mean_c)
+
+    def add_all(self, pairs):
+        for pair in pairs:
+            self.add(pair)
+
+    @property
+    def beta(self):
+        return self.c_yc / self.m2_c if self.m2_c > 0 else 0.0
+
+    @property
+    def mean(self):
+        return self.mean_y - self.beta * (self.mean_c - self.control_mean)
+
+    @property
+    def stderr(self):
+        if self.n < 3:
+            return float("inf")
+        residual_m2 = max(self.m2_y - self.beta * self.c_yc, 0.0)
+        return sqrt(residual_m2 / (self.n - 2) / self.n)
+
+class StratifiedStats:
+    """
+    Running stratified estimate from (stratum, sample) pairs, where stratum k
+    has probability weights[k]
+    """
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.strata = [RunningStats() for _ in weights]
+        self.n = 0
+
+    def add(self, pair):
+        k, y = pair
+        self.strata[k].add(y)
+        self.n += 1
+
+    def add_all(self, pairs):
+        for pair in pairs:
+            self.add(pair)
+
+    @property
+    def mean(self):
+        return sum(w * s.mean for w, s in zip(self.weights, self.strata))
+
+    @property
+    def stderr(self):
+        variance = 0.0
+        for w, s in zip(self.weights, self.strata):
+            if w > 0:
+                variance += w * w * s.variance / s.n if s.n > 0 else float("inf")
+        return sqrt(variance)
+
+class SlowingScenarioSolver:
+    """
+    Max flow values of slowing scenarios of G (boolean masks over
+    self.network.edges of which edges are slowed)
+
+    Scenarios where no slowed edge drops below the flow it carries in a base
+    max flow are screened out: the base flow is still feasible and the max
+    flow can't increase, so the value is the base value without solving
+    (hits). The rest are looked up in cache (a model.ScenarioCache, shared
+    between solvers if given) by their slowed edge bitset and solved
+    otherwise (misses), repaired from the base flow rather than from scratch
+
+    R is a residual graph of G from get_intermediate_residual_graph to take
+    the base flow from, otherwise the base flow is computed
+    """
+
+    def __init__(self, G, sources, sinks, R=None, cache=None):
+        self.network = FlowNetwork(G, sources, sinks)
+        self.cache = md.ScenarioCache() if cache is None else cache
+        self.version = None
+        self.set_capacities(G, R)
+
+    def set_capacities(self, G, R=None):
+        """
+        Re-reads the capacities (and slowing attributes) of G, which must
+        have the same edges as before, invalidating cached values of the old
+        ones (R as in the constructor)
+        """
+        if self.version is not None:
+            self.cache.invalidate(self.version)
+        capacity, slowed_capacity, self.prob = md.get_slowing_arrays(G, self.network.edges)
+        self.set_arrays(capacity, slowed_capacity,
+                        None if R is None else [max(R[u][v]["flow"], 0) for u, v in self.network.edges])
+        self.hits = 0
+        self.misses = 0
+
+    def set_arrays(self, capacity, slowed_capacity, flow=None):
+        """
+        Switches to other capacity and slowed capacity arrays (over
+        self.network.edges, eg. for a what-if capacity increase) with flow
+        as the base max flow if given, cached values of the current arrays
+        are kept for switching back
+        """
+        self.capacity = capacity
+        self.slowed_capacity = slowed_capacity
+        self.version = md.get_graph_version(self.network, self.capacity, self.slowed_capacity)
+
+        self.network.set_base(self.capacity, flow)
+        self.max_flow_val = self.network.base_value
+        self.flow = self.network.base_flow
+
+        # slowing these edges never changes the max flow value
+        self.harmless = self.slowed_capacity >= self.flow
+
+    def _solve(self, slowed):
+        key = np.packbits(slowed).tobytes()
+        value = self.cache.get(self.version, key)
+        if value is None:
+            self.misses += 1
+            value = self.network.repair_max_flow_value(np.where(slowed, self.slowed_capacity, self.capacity))
+            self.cache.put(self.version, key, value)
+        return value
+
+    def max_flow_value(self, slowed_edges):
+        """Max flow value when the edges indexed by slowed_edges are slowed"""
+
+        if all(self.harmless[i] for i in slowed_edges):
+            self.hits += 1
+            return self.max_flow_val
+
+        slowed = np.zeros(len(self.capacity), dtype=bool)
+        slowed[slowed_edges] = True
+        return self._solve(slowed)
+
+    def max_flow_values(self, slowed):
+        """Max flow value of each scenario in a batch of slowed masks"""
+
+        harmful = (slowed & ~self.harmless).any(axis=1)
+        self.hits += int(len(slowed) - harmful.sum())
+
+        max_flow_vals = np.full(len(slowed), self.max_flow_val)
+        max_flow_vals[harmful] = [self._solve(row) for row in slowed[harmful]]
+        return max_flow_vals
+
+class VertexBlockingSimulator:
+    """
+    Max flow values of vertex blocking scenarios of G (boolean masks over
+    self.network.vertices of which nodes are blocked), each blocked node
+    being a zero capacity in -> out arc of one compiled VertexFlowNetwork
+    (so nothing passes through, starts or ends at it)
+
+    As in SlowingScenarioSolver, scenarios only blocking nodes without flow
+    in the base max flow keep the base value (hits) and the rest are
+    repaired from the base flow (misses), with values cached by the bitset
+    of blocked nodes since low blocking probabilities repeat the same
+    scenarios a lot
+
+    G must define "blocking_prob" and "capacity" for each node
+    """
+
+    def __init__(self, G, sources, sinks, cache=None):
+        self.network = VertexFlowNetwork(G, sources, sinks)
+        self.prob = np.array([G.nodes[n]["blocking_prob"] for n in self.network.vertices], dtype=float)
+        self.cache = md.ScenarioCache() if cache is None else cache
+        self.version = md.get_graph_version(self.network, self.network.capacity)
+
+        self.network.set_base()
+        self.max_flow_val = self.network.base_value
+        # blocking these nodes never changes the max flow value
+        self.harmless = self.network.base_flow[len(self.network.edges):] == 0
+        self.hits = 0
+        self.misses = 0
+
+    def sample(self, n, rng=None):
+        """n x V matrix of blocked node masks"""
+
+        return md.get_rng(rng).random((n, len(self.prob))) < self.prob
+
+    def max_flow_values(self, blocked):
+        """Max flow value of each scenario in a batch of blocked masks"""
+
+        harmful = (blocked & ~self.harmless).any(axis=1)
+        self.hits += int(len(blocked) - harmful.sum())
+
+        max_flow_vals = np.full(len(blocked), self.max_flow_val)
+        offset = len(self.network.edges)
+        values = []
+        for row, key in zip(blocked[harmful], np.packbits(blocked[harmful], axis=1)):
+            key = key.tobytes()
+            value = self.cache.get(self.version, key)
+            if value is None:
+                self.misses += 1
+                capacities = self.network.capacity.copy()
+                capacities[offset:][row] = 0
+                value = self.network.repair_max_flow_value(capacities)
+                self.cache.put(self.version, key, value)
+            values.append(value)
+        max_flow_vals[harmful] = values
+        return max_flow_vals
+
+def v_blocking_max_flow_distribution(G, sources, sinks, n, rng=None):
+    """
+    Distribution of the max flow value (with vertex capacities) over n
+    sampled vertex blocking scenarios of G
+
+    Returns the distinct max flow values and their frequencies
+    """
+    simulator = VertexBlockingSimulator(G, sources, sinks)
+    max_flow_vals = simulator.max_flow_values(simulator.sample(n, rng))
+    values, counts = np.unique(max_flow_vals, return_counts=True)
+    return values, counts / n
+
+class EdgeCriticality:
+    """
+    Per edge statistics over sampled slowing scenarios, following the order
+    of edges: cut_freq is how often the edge crosses the minimum cut and
+    marginal is the expected max flow increase from one more unit of
+    capacity on it (how often it is a guaranteed edge)
+
+    ranked indexes edges from most to least critical by marginal (or
+    cut_freq if by="cut_freq"), ties going to the other statistic. Calling it
+    with (R, edges) picks the highest ranked of edges, so it can be passed
+    as the edge_select_func of algorithm.distribute_budget
+    """
+
+    def __init__(self, edges, cut_freq, marginal, by="marginal"):
+        self.edges = edges
+        self.cut_freq = cut_freq
+        self.marginal = marginal
+        score, tiebreak = (marginal, cut_freq) if by == "marginal" else (cut_freq, marginal)
+        self.ranked = np.lexsort((np.arange(len(edges)), -tiebreak, -score))
+        self.rank = {edges[i]: r for r, i in enumerate(self.ranked.tolist())}
+
+    def ranked_edges(self):
+        return [self.edges[i] for i in self.ranked]
+
+    def __call__(self, R, edges):
+        # edges not in G (eg. to the supersink) come last
+        return min(edges, key=lambda e: self.rank.get(e, len(self.rank)))
+
+def estimate_edge_criticality(G, sources, sinks, n, rng=None, by="marginal", batch_size=1000):
+    """
+    Single pass over n sampled slowing scenarios of G recording, for each
+    edge, how often it is on the min cut and whether more capacity on it
+    would help (see EdgeCriticality), from the final residual network of each
+    max flow solve
+
+    Scenarios that only slow edges to above the flow they carry in a base
+    max flow have the same residual reachability as the base, so they reuse
+    the base result
+
+    Returns an EdgeCriticality
+    """
+    rng = md.get_rng(rng)
+    network = FlowNetwork(G, sources, sinks)
+    capacity, slowed_capacity, prob = md.get_slowing_arrays(G, network.edges)
+    _, flow = network.max_flow(capacity)
+    _, base_cut, base_gain = network.critical_edges(capacity)
+    unchanged = slowed_capacity > flow
+
+    cut_count = np.zeros(len(network.edges))
+    gain_count = np.zeros(len(network.edges))
+    for start in range(0, n, batch_size):
+        slowed = rng.random((min(batch_size, n - start), len(prob))) < prob
+        changed = (slowed & ~unchanged).any(axis=1)
+        base_count = len(slowed) - changed.sum()
+        cut_count += base_count * base_cut
+        gain_count += base_count * base_gain
+        for row in np.where(slowed[changed], slowed_capacity, capacity):
+            _, cut, gain = network.critical_edges(row)
+            cut_count += cut
+            gain_count += gain
+
+    return EdgeCriticality(network.edges, cut_count / n, gain_count / n, by)
+
+def is_precise(stats, rel_err=None, half_width=None, z=1.96):
+    """
+    Whether the z confidence interval of stats.mean has half width within
+    half_width and/or within rel_err * |mean|
+    """
+    ci = z * stats.stderr
+    if half_width is not None and ci > half_width:
+        return False
+    if rel_err is not None and ci > rel_err * abs(stats.mean):
+        return False
+    return True
+
+def estimate(sample, rel_err=None, half_width=None, max_samples=10000,
+             min_samples=30, batch_size=1, z=1.96, stats=None):
+    """
+    Averages samples until the target precision (see is_precise) is met or
+    max_samples have been drawn (always max_samples without a target)
+
+    sample(n) should return n independent samples, it is called with at most
+    batch_size at a time. stats accumulates the samples (RunningStats by
+    default, see ControlVariateStats and StratifiedStats for the others)
+
+    Returns the mean, standard error and number of samples used
+    """
+    if stats is None:
+        stats = RunningStats()
+    has_target = rel_err is not None or half_width is not None
+    while stats.n < max_samples:
+        stats.add_all(sample(min(batch_size, max_samples - stats.n)))
+        if stats.n >= min_samples and has_target and is_precise(stats, rel_err, half_width, z):
+            break
+
+    return float(stats.mean), float(stats.stderr), stats.n
+
+def estimate_slowing_max_flow(G, sources, sinks, rel_err=None, half_width=None,
+                              max_samples=10000, min_samples=30, batch_size=100,
+                              z=1.96, rng=None, variance_reduction=None,
+                              importance_prob=0.25, importance_mix=0.5, strata=8):
+    """
+    Adaptive precision version of averaging get_probabilistic_slowing_max_flow,
+    scenarios are drawn batch_size at a time and solved by one
+    SlowingScenarioSolver
+
+    variance_reduction can be
+    - "antithetic": each sample averages a scenario and its antithetic twin
+    - "stratified": stratifies on the number of slowed edges (0 to strata - 1
+      exactly, and at least strata), with fewer strata if max_samples can't
+      give each one the two samples its variance estimate needs
+    - "importance": slowing probabilities of the min cut edges are raised to
+      at least importance_prob in a share (1 - importance_mix) of the samples,
+      the loss from the unslowed max flow is weighted by the likelihood ratio
+    - "control": uses the capacity of the min cut of the expected capacity
+      graph (whose expectation is the expected max flow) as a control variate
+
+    Returns the mean, standard error and number of samples used
+    """
+    solver = SlowingScenarioSolver(G, sources, sinks)
+    network = solver.network
+    rng = md.get_rng(rng)
+    capacity, slowed_capacity, prob = solver.capacity, solver.slowed_capacity, solver.prob
+    stats = None
+
+    def solve(slowed):
+        return solver.max_flow_values(slowed).tolist()
+
+    if variance_reduction is None:
+        def sample(n):
+            return solve(rng.random((n, len(prob))) < prob)
+
+    elif variance_reduction == "antithetic":
+        def sample(n):
+            u = rng.random((n, len(prob)))
+            return [(a + b) / 2 for a, b in zip(solve(u < prob), solve(1 - u < prob))]
+
+    elif variance_reduction == "stratified":
+        strata = max(min(strata, max_samples // 2 - 1), 0)
+        at_least = _count_tail_probs(prob, strata)
+        # probability of exactly k slowed edges, the last stratum is the tail
+        weights = np.append(at_least[0, :-1] - at_least[0, 1:], at_least[0, -1])
+        weights = np.clip(weights, 0, None)
+        stats = StratifiedStats(weights)
+
+        def sample(n):
+            # every stratum needs a couple of samples for a variance estimate,
+            # the heaviest strata short of them get them first
+            counts = np.zeros(len(weights), dtype=int)
+            for k in np.argsort(-weights, kind="stable"):
+                if weights[k] > 0:
+                    counts[k] = min(max(2 - stats.strata[k].n, 0), n - counts.sum())
+            # proportional allocation of the rest, rounding by the largest remainders
+            rest = n - counts.sum()
+            extra = np.floor(weights * rest).astype(int)
+            extra[np.argsort(extra - weights * rest)[:rest - extra.sum()]] += 1
+            counts += extra
+            samples = []
+            for k, count in enumerate(counts):
+                if count > 0:
+                    slowed = _sample_slowed_count(prob, at_least, k, k == strata, count, rng)
+                    samples += [(k, y) for y in solve(slowed)]
+            return samples
+
+    elif variance_reduction == "importance":
+        _, cut = network.min_cut(capacity)
+        base_max_flow_val = solver.max_flow_val
+        tilted = np.where(cut & (prob > 0), np.maximum(prob, importance_prob), prob)
+        # log of tilted / original likelihood for slowed and not slowed edges
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_slowed = np.where(tilted > prob, np.log(tilted) - np.log(prob), 0)
+            log_kept = np.where(tilted > prob, np.log1p(-tilted) - np.log1p(-prob), 0)
+
+        def sample(n):
+            # defensive mixture of the original and tilted distributions so
+            # the likelihood ratio stays below 1 / importance_mix
+            from_tilted = rng.random(n) >= importance_mix
+            slowed = rng.random((n, len(prob))) < np.where(from_tilted[:, None], tilted, prob)
+            ratio = np.exp(np.where(slowed, log_slowed, log_kept).sum(axis=1))
+            weight = 1 / (importance_mix + (1 - importance_mix) * ratio)
+            # only the (mostly zero) loss from the unslowed max flow is weighted
+            return [base_max_flow_val - (base_max_flow_val - y) * w for y, w in zip(solve(slowed), weight)]
+
+    elif variance_reduction == "control":
+        expected = capacity * (1 - prob) + slowed_capacity * prob
+        _, cut = _expected_min_cut(G, sources, sinks, network)
+        stats = ControlVariateStats(expected[cut].sum())
+
+        def sample(n):
+            slowed = rng.random((n, len(prob))) < prob
+            control = np.where(slowed, slowed_capacity, capacity)[:, cut].sum(axis=1)
+            return list(zip(solve(slowed), control))
+
+    else:
+        raise ValueError(f"unknown variance reduction {variance_reduction}")
+
+    return estimate(sample, rel_err, half_width, max_samples, min_samples, batch_size, z, stats)
+
+def _expected_min_cut(G, sources, sinks, network):
+    """
+    Min cut value and cut edge mask (over network.edges) of the expected
+    capacity graph of G
+    """
+    G = md.get_expected_capacity_graph(G)
+    for source in sources:
+        G.add_edge("source", source)
+    for sink in sinks:
+        G.add_edge(sink, "sink")
+    cut_val, (reachable, _) = nx.minimum_cut(G, "source", "sink")
+
+    return cut_val, np.array([u in reachable and v not in reachable for u, v in network.edges])
+
+def _count_tail_probs(prob, strata):
+    """
+    at_least[i, j] is the probability that at least j of the edges i onwards
+    are slowed (for j up to strata)
+    """
+    at_least = np.zeros((len(prob) + 1, strata + 1))
+    at_least[:, 0] = 1
+    for i in range(len(prob) - 1, -1, -1):
+        at_least[i, 1:] = prob[i] * at_least[i + 1, :-1] + (1 - prob[i]) * at_least[i + 1, 1:]
+
+    return at_least
+
+def _sample_slowed_count(prob, at_least, k, tail, n, rng):
+    """
+    Draws n slowed edge masks conditioned on exactly k slowed edges (or at
+    least k if tail) by sequentially sampling each edge given the rest
+    """
+    if tail:
+        def remaining(i, j):
+            return at_least[i, j]
+    else:
+        def remaining(i, j):
+            return at_least[i, j] - at_least[i, j + 1]
+
+    need = np.full(n, k)
+    u = rng.random((n, len(prob)))
+    slowed = np.zeros((n, len(prob)), dtype=bool)
+    for i in range(len(prob)):
+        denom = remaining(i, need)
+        # when nothing is needed anymore in the tail, edges are unconditioned
+        p = np.where(need > 0, prob[i] * remaining(i + 1, np.maximum(need - 1, 0)) / np.where(denom > 0, denom, 1),
+                     prob[i] if tail else 0)
+        slowed[:, i] = u[:, i] < p
+        need = np.maximum(need - slowed[:, i], 0)
+
+    return slowed
+
+def estimate_v_blocking_max_flow(G, sources, sinks, rel_err=None, half_width=None,
+                                 max_samples=10000, min_samples=30, z=1.96,
+                                 base_problem_func=md.get_max_flow_with_v_capacity,
+                                 batch_size=100, rng=None):
+    """
+    Adaptive precision version of averaging get_probabilistic_v_blocking_max_flow
+
+    The default base_problem_func is simulated batch_size scenarios at a time
+    with a VertexBlockingSimulator
+
+    Returns the mean, standard error and number of samples used
+    """
+    if base_problem_func is md.get_max_flow_with_v_capacity:
+        rng = md.get_rng(rng)
+        simulator = VertexBlockingSimulator(G, sources, sinks)
+
+        def sample(n):
+            return simulator.max_flow_values(simulator.sample(n, rng)).tolist()
+
+        return estimate(sample, rel_err, half_width, max_samples, min_samples, batch_size, z)
+
+    def sample(n):
+        return [md.get_flow_val(md.get_probabilistic_v_blocking_max_flow(G, sources, sinks, base_problem_func), sinks)
+                for _ in range(n)]
+
+    return estimate(sample, rel_err, half_width, max_samples, min_samples, 1, z)
+
+# per worker process state, set once by _init_worker
+_worker = {}
+
+def _init_worker(G, sources, sinks, problem):
+    if problem == "slowing":
+        _worker["solver"] = SlowingScenarioSolver(G, sources, sinks)
+    elif problem == "v_blocking":
+        _worker["solver"] = VertexBlockingSimulator(G, sources, sinks)
+    else:
+        raise ValueError(f"unknown problem {problem}")
+
+def _run_shard(problem, n, seed_seq):
+    stats = RunningStats()
+    solver = _worker["solver"]
+    rng = np.random.default_rng(seed_seq)
+    if problem == "slowing":
+        slowed = rng.random((n, len(solver.prob))) < solver.prob
+        stats.add_all(solver.max_flow_values(slowed).tolist())
+    else:
+        stats.add_all(solver.max_flow_values(solver.sample(n, rng)).tolist())
+    return stats
+
+def parallel_estimate(G, sources, sinks, iterations, problem="slowing", workers=None,
+                      shard_size=1000, seed=None):
+    """
+    Averages iterations samples of the probabilistic max flow of G over a
+    process pool, problem is "slowing" (get_probabilistic_slowing_max_flow)
+    or "v_blocking" (get_probabilistic_v_blocking_max_flow)
+
+    G is sent to each worker once, and the iterations are split into shards
+    of shard_size with independent seeds spawned from seed (drawn from the
+    random module if not given), so results only depend on seed and
+    shard_size and not on the number of workers
+
+    Returns the mean, standard error and number of samples used
+    """
+    if problem not in ("slowing", "v_blocking"):
+        raise ValueError(f"unknown problem {problem}")
+    if seed is None:
+        seed = rand.getrandbits(64)
+    shards = ceil(iterations / shard_size)
+    sizes = [min(shard_size, iterations - i * shard_size) for i in range(shards)]
+    seeds = np.random.SeedSequence(seed).spawn(shards)
+
+    stats = RunningStats()
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(G, sources, sinks, problem)) as executor:
+        # merge in shard order so floating point results are reproducible
+        for shard_stats in executor.map(_run_shard, [problem] * shards, sizes, seeds):
+            stats.merge(shard_stats)
+
+    return stats.mean, stats.stderr, stats.n
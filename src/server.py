@@ -0,0 +1,304 @@
+from concurrent.futures import ThreadPoolExecutor
+from gen_graph import gen_graph_max_flow
+from math import sqrt
+import algorithm as ag
+import argparse
+import asyncio
+import json
+import max_flow_increase_bfs as mf
+import model as md
+import monte_carlo as mc
+import networkx as nx
+import numpy as np
+import random
+import socket
+import sys
+import target_edges as te
+
+# allocation strategies by name, as (distribute function, edge_select_func)
+strategies = {
+    "exact": (None, None),
+    "get_lowest_ev_edge": (ag.distribute_budget, ag.get_lowest_ev_edge),
+    "get_highest_ev_edge": (ag.distribute_budget, ag.get_highest_ev_edge),
+    "get_lowest_prob_edge": (ag.distribute_budget, ag.get_lowest_prob_edge),
+    "get_highest_prob_edge": (ag.distribute_budget, ag.get_highest_prob_edge),
+    "get_edge_and_cap_inc_by_cap": (ag.distribute_budget_fair, ag.get_edge_and_cap_inc_by_cap),
+    "get_random_edge": (ag.distribute_budget, ag.get_random_edge),
+}
+
+# gen_graph_max_flow parameters a client may set (no file paths)
+netgen_params = {"seed", "nodes", "sources", "sinks", "density", "mincost", "maxcost", "supply",
+                 "tsources", "tsinks", "hicost", "capacitated", "mincap", "maxcap", "rng", "type"}
+
+class WhatIfSession:
+    """
+    Warm state of one network for what-if queries: the base residual graph
+    R, a SlowingScenarioSolver (with its scenario cache) and one matrix of
+    slowing scenarios that every query is evaluated on, so expected max flow
+    changes are paired differences against the same base values
+
+    A capacity increase is applied to R under an UndoJournal and augmented
+    from the base flow, and the resulting flow is the starting point for
+    the scenario solves, so nothing is recomputed from scratch
+
+    Not thread safe - WhatIfServer runs one query per session at a time
+    """
+
+    def __init__(self, G, sources, sinks, iterations=1000, rng=None):
+        self.G = G
+        self.sources = sources
+        self.sinks = sinks
+        self.max_flow_val, self.R = md.get_intermediate_residual_graph(G, sources, sinks, nx.flow.preflow_push)
+        self.solver = mc.SlowingScenarioSolver(G, sources, sinks, self.R)
+        self.edges = self.solver.network.edges
+        self.edge_index = {e: i for i, e in enumerate(self.edges)}
+        self.factor = np.array([G.edges[e]["slowing_factor"] for e in self.edges], dtype=float)
+        self.base = (self.solver.capacity, self.solver.slowed_capacity, self.solver.flow)
+
+        self.slowed = md.get_rng(rng).random((iterations, len(self.edges))) < self.solver.prob
+        self.base_values = self.solver.max_flow_values(self.slowed)
+        # deterministic strategies give the same allocation every time
+        self.allocations = {}
+        self.queries = 0
+
+    def summary(self):
+        return {
+            "nodes": self.G.number_of_nodes(),
+            "edges": self.G.number_of_edges(),
+            "iterations": len(self.slowed),
+            "max_flow": self.max_flow_val,
+            "expected_max_flow": float(self.base_values.mean()),
+        }
+
+    def stats(self):
+        return dict(self.summary(), queries=self.queries, allocations_cached=len(self.allocations),
+                    screened=self.solver.hits, solved=self.solver.misses,
+                    cache_size=len(self.solver.cache), cache_hits=self.solver.cache.hits,
+                    cache_misses=self.solver.cache.misses)
+
+    def _expected(self, increases, R):
+        """
+        Expected max flow over the scenarios with increases ({edge: capacity
+        increase}) applied, R holding a max flow with them
+        """
+        capacity, slowed_capacity, _ = self.base
+        capacity = capacity.copy()
+        slowed_capacity = slowed_capacity.copy()
+        idx = np.array([self.edge_index[e] for e in increases], dtype=np.int64)
+        capacity[idx] += np.array(list(increases.values()), dtype=capacity.dtype)
+        slowed_capacity[idx] = np.ceil(capacity[idx] * (1 - self.factor[idx])).astype(capacity.dtype)
+
+        self.solver.set_arrays(capacity, slowed_capacity, [max(R[u][v]["flow"], 0) for u, v in self.edges])
+        try:
+            diff = self.solver.max_flow_values(self.slowed) - self.base_values
+        finally:
+            self.solver.set_arrays(*self.base)
+
+        n = len(diff)
+        return {
+            "expected_max_flow": float(self.base_values.mean() + diff.mean()),
+            "expected_improvement": float(diff.mean()),
+            "expected_improvement_stderr": float(diff.std(ddof=1) / sqrt(n)) if n > 1 else float("inf"),
+        }
+
+    def bump(self, increases):
+        """
+        Max flow and expected max flow if each edge in increases ({edge:
+        capacity increase}) gets that much more capacity
+        """
+        for (u, v), k in increases.items():
+            if (u, v) not in self.edge_index:
+                raise ValueError("no edge (%s, %s)" % (u, v))
+            if k < 0:
+                raise ValueError("capacity increase of (%s, %s) is negative" % (u, v))
+        self.queries += 1
+
+        journal = ag.UndoJournal(self.R)
+        try:
+            for (u, v), k in increases.items():
+                journal.record(u, v, "capacity")
+                self.R[u][v]["capacity"] += k
+            increase = mf.apply_max_flow_increase_dinic(self.R, "source", "sink", journal=journal)
+            res = {"max_flow": self.max_flow_val + increase, "max_flow_increase": increase}
+            res.update(self._expected(increases, self.R))
+        finally:
+            journal.rollback()
+        return res
+
+    def allocate(self, budget, strategy):
+        """Distribution of budget by strategy (see strategies) and what it does to the (expected) max flow"""
+
+        if strategy not in strategies:
+            raise ValueError("unknown strategy %r" % strategy)
+        if budget < 0:
+            raise ValueError("budget is negative")
+        self.queries += 1
+        if (budget, strategy) in self.allocations:
+            return self.allocations[(budget, strategy)]
+
+        distribute, edge_select_func = strategies[strategy]
+        if distribute is None:
+            dist, R_c = ag.distribute_budget_exact(self.R, budget)
+        else:
+            dist, R_c = distribute(self.R, budget, te.get_guaranteed_edges, edge_select_func)
+        dist = {e: k for e, k in dist.items() if k > 0}
+
+        # (for the exact distribution, a path through several upgraded edges
+        # spends more capacity than the flow it adds)
+        max_flow_val = sum(R_c["source"][v]["flow"] for v in R_c["source"])
+        res = {"distribution": [[u, v, k] for (u, v), k in dist.items()],
+               "capacity_added": sum(dist.values()), "max_flow": max_flow_val,
+               "max_flow_increase": max_flow_val - self.max_flow_val}
+        res.update(self._expected(dist, R_c))
+        if edge_select_func != ag.get_random_edge:
+            self.allocations[(budget, strategy)] = res
+        return res
+
+def load_session(netgen, attrs_seed=None, iterations=1000, seed=None, cache_dir=None):
+    """
+    WhatIfSession of a gen_graph_max_flow graph (netgen being its parameters)
+    with random slowing attributes from attrs_seed and iterations scenarios
+    drawn from seed
+
+    The attributes come from a random.Random of their own, so concurrent
+    loads (and allocations) don't disturb each other's draws
+    """
+    unknown = set(netgen) - netgen_params
+    if unknown:
+        raise ValueError("unknown netgen parameters %s" % ", ".join(sorted(map(repr, unknown))))
+    params = dict({"mincost": 1, "maxcost": 1, "supply": 0}, **netgen)
+    G, sources, sinks = gen_graph_max_flow(cache_dir=cache_dir, **params)
+    md.set_random_probabilistic_attrs(G, random=random.Random(attrs_seed))
+    return WhatIfSession(G, sources, sinks, iterations, np.random.default_rng(seed))
+
+class WhatIfServer:
+    """
+    Serves what-if queries over networks kept loaded as WhatIfSessions, one
+    JSON request per line and one JSON response per line:
+
+    {"op": "load", "network": name, "netgen": {gen_graph_max_flow parameters, see netgen_params},
+     "attrs_seed": ..., "iterations": ..., "seed": ...}
+    {"op": "bump", "network": name, "edges": [[u, v, k], ...]}
+    {"op": "allocate", "network": name, "budget": B, "strategy": S}
+    {"op": "stats", "network": name}, {"op": "networks"}, {"op": "unload", "network": name}
+
+    Responses are {"ok": true, "result": ...} or {"ok": false, "error": ...}
+    (with the request's "id" if it had one)
+
+    Every connection shares the loaded sessions, queries run on a thread
+    pool so the server keeps answering while one computes, one at a time
+    per network
+    """
+
+    def __init__(self, cache_dir=None, workers=None):
+        self.cache_dir = cache_dir
+        self.sessions = {}
+        self.locks = {}
+        self.executor = ThreadPoolExecutor(workers)
+
+    def _lock(self, name):
+        if name not in self.locks:
+            self.locks[name] = asyncio.Lock()
+        return self.locks[name]
+
+    def _session(self, request):
+        name = request.get("network")
+        if name not in self.sessions:
+            raise KeyError("unknown network %r" % name)
+        return self.sessions[name]
+
+    async def _run(self, name, func, *args):
+        async with self._lock(name):
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def dispatch(self, request):
+        op = request.get("op")
+        if op == "networks":
+            return {name: session.summary() for name, session in self.sessions.items()}
+        if op == "load":
+            name = request["network"]
+            session = await self._run(name, load_session, request["netgen"], request.get("attrs_seed"),
+                                      request.get("iterations", 1000), request.get("seed"), self.cache_dir)
+            self.sessions[name] = session
+            return session.summary()
+        if op == "unload":
+            self._session(request)
+            del self.sessions[request["network"]]
+            return None
+
+        if op not in ("stats", "bump", "allocate"):
+            raise ValueError("unknown op %r" % op)
+        session = self._session(request)
+        if op == "stats":
+            return session.stats()
+        if op == "bump":
+            increases = {}
+            for u, v, k in request["edges"]:
+                increases[(str(u), str(v))] = increases.get((str(u), str(v)), 0) + k
+            return await self._run(request["network"], session.bump, increases)
+        return await self._run(request["network"], session.allocate,
+                               request["budget"], request.get("strategy", "exact"))
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = {}
+                try:
+                    request = json.loads(line)
+                    response = {"ok": True, "result": await self.dispatch(request)}
+                except Exception as e:
+                    # a bad query shouldn't take the connection (or server) down
+                    response = {"ok": False, "error": str(e.args[0]) if e.args else repr(e)}
+                if isinstance(request, dict) and "id" in request:
+                    response["id"] = request["id"]
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, path=None, host="127.0.0.1", port=8765):
+        """Serves on the Unix socket path if given, otherwise on host:port, until cancelled"""
+
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+def query(request, path=None, host="127.0.0.1", port=8765):
+    """Sends one request to a WhatIfServer and returns its response (a blocking client for scripts)"""
+
+    if path is not None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+    else:
+        sock = socket.create_connection((host, port))
+    with sock, sock.makefile("rwb") as f:
+        f.write(json.dumps(request).encode() + b"\n")
+        f.flush()
+        return json.loads(f.readline())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="What-if query server keeping networks, residual flows and scenario caches warm")
+    parser.add_argument("--socket", help="Unix socket path (default: TCP on --host/--port)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, help="query threads")
+    parser.add_argument("--cache-dir", help="netgen graph cache (see gen_graph.load_netgen)")
+
+    args = parser.parse_args(argv)
+    server = WhatIfServer(args.cache_dir, args.workers)
+    try:
+        asyncio.run(server.serve(args.socket, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,10 @@
 from gen_graph import gen_graph_max_flow
 import model as md
 import networkx as nx
+import numpy as np
 import random
+from flow_network import FlowNetwork
+from math import sqrt
 from algorithm import *
 from target_edges import *
 import pprint
@@ -15,38 +18,73 @@ edge_select_funcs = [
     get_random_edge,
 ]
 
-def calc_prob_max_flow(G, sources, sinks, iterations):
-    total = 0
-    for _ in range(iterations):
-        total += md.get_probabilistic_slowing_max_flow(G, sources, sinks)
-    return total / iterations
+def calc_prob_max_flow(G, sources, sinks, iterations, cache=None):
+    _, mean = md.get_probabilistic_slowing_max_flows(G, sources, sinks, iterations, cache=cache)
+    return float(mean)
 
-def test_one_graph(iterations, budget_increment, budget_min, budget_max, mincap, maxcap, nodes, density):
+def calc_scenario_max_flows(G, H, sources, sinks, scenarios):
+    """
+    Replays scenarios (iterations x E matrix of uniform draws over G.edges,
+    an edge is slowed if its draw < slowing_prob) against H, whose edges
+    must be a subset of G's (e.g. a cleaned modified residual graph)
+
+    Returns the max flow value of H in each scenario
+    """
+    column = {e: i for i, e in enumerate(G.edges)}
+    network = FlowNetwork(H, sources, sinks)
+    capacity, slowed_capacity, prob = md.get_slowing_arrays(H, network.edges)
+    slowed = scenarios[:, [column[e] for e in network.edges]] < prob
+    capacities = np.where(slowed, slowed_capacity, capacity)
+
+    return np.array([network.max_flow_value(row) for row in capacities])
+
+def test_one_graph(iterations, budget_increment, budget_min, budget_max, mincap, maxcap, nodes, density,
+                   common_random_numbers=False):
+    """
+    With common_random_numbers, one scenario matrix is sampled for the graph
+    and replayed against the original and every modified graph, improvements
+    are then paired differences (with their standard error)
+    """
     G, sources, sinks = gen_graph_max_flow(mincost=1, maxcost=1, supply=0,
-                                           mincap=mincap, maxcap=maxcap, fname='test.net',
+                                           mincap=mincap, maxcap=maxcap,
                                            nodes=nodes, density=density,
                                            seed=-1)
     md.set_random_probabilistic_attrs(G)
 
     res = {"graph": G, "results": {}}
+    # repeated scenarios (e.g. nothing slowed) are only solved once, the
+    # cache goes away with the graph
+    cache = md.ScenarioCache()
 
-    original_max = calc_prob_max_flow(G, sources, sinks, iterations)
+    if common_random_numbers:
+        scenarios = md.get_rng().random((iterations, G.number_of_edges()))
+        original_vals = calc_scenario_max_flows(G, G, sources, sinks, scenarios)
+        original_max = float(original_vals.mean())
+    else:
+        original_max = calc_prob_max_flow(G, sources, sinks, iterations, cache)
 
     _, R = md.get_intermediate_residual_graph(G, sources, sinks, nx.flow.preflow_push)
 
     for edge_select_func in edge_select_funcs:
         res["results"][edge_select_func.__name__] = []
 
-        for budget in range(budget_min, budget_max + 1, budget_increment):
-            if edge_select_func == get_edge_and_cap_inc_by_cap:
-                # Use a different budget distribution function for this specific function
-                dist, R_c = distribute_budget_fair(R, budget, get_guaranteed_edges, edge_select_func)
-            else:
-                dist, R_c = distribute_budget(R, budget, get_guaranteed_edges, edge_select_func)
+        # Every budget level comes out of one greedy run
+        budgets = range(budget_min, budget_max + 1, budget_increment)
+        # Use the fair budget distribution for this specific function
+        sweep = sweep_budget(R, budgets, get_guaranteed_edges, edge_select_func,
+                             fair=edge_select_func == get_edge_and_cap_inc_by_cap)
+
+        for budget in budgets:
+            dist, R_c = sweep[budget]
 
             md.clean_residual_graph(R_c)
-            new_max = calc_prob_max_flow(R_c, sources, sinks, iterations)
-            improvement = new_max - original_max
+            if common_random_numbers:
+                diff = calc_scenario_max_flows(G, R_c, sources, sinks, scenarios) - original_vals
+                improvement = float(diff.mean())
+                new_max = original_max + improvement
+            else:
+                new_max = calc_prob_max_flow(R_c, sources, sinks, iterations, cache)
+                improvement = new_max - original_max
 
             res["results"][edge_select_func.__name__].append({
                 'original_max_flow': original_max,
@@ -54,6 +92,9 @@ def test_one_graph(iterations, budget_increment, budget_min, budget_max, mincap,
                 'new_max_flow': new_max,
                 'improvement': improvement,
             })
+            if common_random_numbers:
+                res["results"][edge_select_func.__name__][-1]['improvement_stderr'] = \
+                    float(diff.std(ddof=1) / sqrt(iterations)) if iterations > 1 else float("inf")
     
     return res
 
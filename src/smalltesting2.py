@@ -16,14 +16,12 @@ edge_select_funcs = [
 ]
 
 def calc_prob_max_flow(G, sources, sinks, iterations):
-    total = 0
-    for _ in range(iterations):
-        total += md.get_probabilistic_slowing_max_flow(G, sources, sinks)
-    return total / iterations
+    _, mean = md.get_probabilistic_slowing_max_flows(G, sources, sinks, iterations)
+    return float(mean)
 
 def test_one_graph(iterations, budget_increment, budget_min, budget_max, mincap, maxcap, nodes, density):
     G, sources, sinks = gen_graph_max_flow(mincost=1, maxcost=1, supply=0,
-                                           mincap=mincap, maxcap=maxcap, fname='test.net',
+                                           mincap=mincap, maxcap=maxcap,
                                            nodes=nodes, density=density,
                                            seed=-1)
     md.set_random_probabilistic_attrs(G)
@@ -43,4 +43,181 @@ def get_guaranteed_edges(R):
         if u in s_reachable and v in t_reachable and R[u][v]["capacity"] > 0:
             edges.append((u, v))
 
-    return edges
\ No newline at end of file
+    return edges
+
+class ResidualTree:
+    """
+    Breadth first search tree of the nodes reachable from root in the
+    residual graph R (or that can reach root if reverse), kept up to date
+    with update as residual capacities change
+    """
+
+    def __init__(self, R, root, reverse=False):
+        self.R = R
+        self.root = root
+        self.reverse = reverse
+        self.parent = {root: None}
+        self.children = {root: set()}
+        self._attached = []
+        self._grow(deque([root]))
+        self._attached = []
+
+    def _arcs(self, node):
+        """Residual arcs leading away from the root at node, as (u, v, next)"""
+
+        if self.reverse:
+            return ((u, node, u) for u in self.R.pred[node])
+        return ((node, v, v) for v in self.R.succ[node])
+
+    def _open(self, u, v):
+        return self.R[u][v]["capacity"] - self.R[u][v]["flow"] > 0
+
+    def _attach(self, node, parent):
+        self._attached.append(node)
+        self.parent[node] = parent
+        self.children[node] = set()
+        self.children[parent].add(node)
+
+    def _grow(self, queue):
+        while queue:
+            node = queue.popleft()
+            if node not in self.parent:
+                # orphaned again after being queued
+                continue
+            for u, v, nxt in self._arcs(node):
+                if nxt not in self.parent and self._open(u, v):
+                    self._attach(nxt, node)
+                    queue.append(nxt)
+
+    def update(self, arcs):
+        """
+        Re-examines residual arcs (u, v) whose residual capacity changed:
+        tree arcs that became saturated orphan their subtree, which is then
+        re-adopted from the rest of the tree where possible, and arcs that
+        became unsaturated grow the tree
+
+        Returns the set of nodes that joined or left the tree
+        """
+        self._attached = []
+        orphans = []
+        queue = deque()
+        for u, v in arcs:
+            node, parent = (u, v) if self.reverse else (v, u)
+            if node in self.parent and self.parent[node] == parent and not self._open(u, v):
+                # cut the subtree off (it may still be reachable another way)
+                self.children[parent].discard(node)
+                stack = [node]
+                while stack:
+                    n = stack.pop()
+                    stack.extend(self.children.pop(n))
+                    del self.parent[n]
+                    orphans.append(n)
+            elif parent in self.parent and node not in self.parent and self._open(u, v):
+                self._attach(node, parent)
+                queue.append(node)
+
+        for n in orphans:
+            if n in self.parent:
+                continue
+            # adopt from any remaining tree node with an open arc towards n
+            arcs_in = ((n, v, v) for v in self.R.succ[n]) if self.reverse \
+                else ((u, n, u) for u in self.R.pred[n])
+            for u, v, p in arcs_in:
+                if p in self.parent and self._open(u, v):
+                    self._attach(n, p)
+                    queue.append(n)
+                    break
+
+        self._grow(queue)
+
+        left = {n for n in orphans if n not in self.parent}
+        joined = set(self._attached).difference(orphans)
+        self._attached = []
+        return left | joined
+
+    def __contains__(self, node):
+        return node in self.parent
+
+class ReachabilityIndex:
+    """
+    Source/sink reachability of a residual graph R, built once and updated
+    with update(arcs) after R's residual capacities change (e.g. after an
+    augmentation) instead of being recomputed by get_guaranteed_edges and
+    get_min_cut_edges every time
+
+    R's edges must stay the same while the index is used
+    """
+
+    def __init__(self, R):
+        self.R = R
+        self.s_reachable = ResidualTree(R, "source")
+        # nodes that can reach the sink (reachable in the reversed graph)
+        self.t_reaching = ResidualTree(R, "sink", reverse=True)
+        self.t_reachable = None
+
+    def update(self, arcs):
+        """
+        Returns the nodes that joined or left the source side and those that
+        joined or left the sink side
+        """
+        arcs = list(arcs)
+        s_changed = self.s_reachable.update(arcs)
+        t_changed = self.t_reaching.update(arcs)
+        if self.t_reachable is not None:
+            t_changed |= self.t_reachable.update(arcs)
+        return s_changed, t_changed
+
+    def is_guaranteed(self, u, v):
+        """Whether (u, v) is one of guaranteed_edges()"""
+
+        return u in self.s_reachable and v in self.t_reaching \
+            and u != "source" and u != "sink" and v != "sink" and v != "source" \
+            and self.R[u][v]["capacity"] > 0
+
+    def is_min_cut(self, u, v):
+        """Whether (u, v) is one of min_cut_edges()"""
+
+        if self.t_reachable is None:
+            self.t_reachable = ResidualTree(self.R, "sink")
+        return u in self.s_reachable and v in self.t_reachable \
+            and u != "source" and v != "sink" and self.R[u][v]["capacity"] > 0
+
+    def guaranteed_edges(self):
+        """Same edges (in the same order) as get_guaranteed_edges(self.R)"""
+
+        edges = []
+        for u, nbrs in self.R.adj.items():
+            if u not in self.s_reachable or u == "source" or u == "sink":
+                continue
+            for v, attr in nbrs.items():
+                if v in self.t_reaching and v != "sink" and v != "source" and attr["capacity"] > 0:
+                    edges.append((u, v))
+
+        return edges
+
+    def min_cut_edges(self):
+        """Same edges (in the same order) as get_min_cut_edges(self.R)"""
+
+        if self.t_reachable is None:
+            self.t_reachable = ResidualTree(self.R, "sink")
+        edges = []
+        for u, nbrs in self.R.adj.items():
+            if u not in self.s_reachable or u == "source":
+                continue
+            for v, attr in nbrs.items():
+                if v in self.t_reachable and v != "sink" and attr["capacity"] > 0:
+                    edges.append((u, v))
+
+        return edges
+
+# index methods matching the edge_func functions above
+indexed_edge_funcs = {
+    get_guaranteed_edges: ReachabilityIndex.guaranteed_edges,
+    get_min_cut_edges: ReachabilityIndex.min_cut_edges,
+}
+
+# index methods testing whether an edge is in the edge_func list
+indexed_edge_tests = {
+    get_guaranteed_edges: ReachabilityIndex.is_guaranteed,
+    get_min_cut_edges: ReachabilityIndex.is_min_cut,
+}
@@ -0,0 +1,25 @@
+"""Small seeded graphs shared by the tests"""
+
+import networkx as nx
+import random
+
+def random_graph(seed, nodes=30, density=120):
+    """Seeded random max flow graph (node ids as strings, with slowing attributes), its sources and sinks"""
+
+    rand = random.Random(seed)
+    G = nx.DiGraph()
+    G.add_nodes_from(str(n) for n in range(nodes))
+    while G.number_of_edges() < density:
+        u, v = rand.sample(range(nodes), 2)
+        G.add_edge(str(u), str(v), capacity=rand.randint(1, 15),
+                   slowing_prob=rand.uniform(0, 0.2), slowing_factor=rand.uniform(0, 1))
+    return G, {"0", "1", "2"}, {str(nodes - 2), str(nodes - 1)}
+
+def nx_max_flow_value(G, sources, sinks, capacities=None):
+    H = G.copy()
+    if capacities is not None:
+        for e, k in zip(G.edges, capacities):
+            H.edges[e]["capacity"] = int(k)
+    H.add_edges_from(("source", s) for s in sources)
+    H.add_edges_from((t, "sink") for t in sinks)
+    return nx.maximum_flow_value(H, "source", "sink")
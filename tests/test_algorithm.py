@@ -0,0 +1,97 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import algorithm as ag
+import itertools
+import model as md
+import networkx as nx
+import pytest
+import target_edges as te
+
+def small_residual():
+    G = nx.DiGraph()
+    # a -> b and a -> c are the bottleneck, the rest has room to spare
+    for u, v, capacity in [("a", "b", 3), ("a", "c", 2), ("b", "c", 5), ("b", "d", 4),
+                           ("c", "d", 6), ("d", "e", 12), ("c", "e", 3)]:
+        G.add_edge(u, v, capacity=capacity, slowing_prob=0.1, slowing_factor=0.5)
+    _, R = md.get_intermediate_residual_graph(G, {"a"}, {"e"}, nx.flow.preflow_push)
+    return R
+
+def residual_state(R):
+    return {e: (R.edges[e]["capacity"], R.edges[e]["flow"]) for e in R.edges}
+
+def test_sweep_budget_zero_and_duplicate_levels():
+    R = small_residual()
+    budgets = [0, 3, 3, 0, 8]
+    for distribute, select, fair in [(ag.distribute_budget, ag.get_highest_ev_edge, False),
+                                     (ag.distribute_budget_fair, ag.get_edge_and_cap_inc_by_cap, True)]:
+        sweep = ag.sweep_budget(R, budgets, te.get_guaranteed_edges, select, fair=fair)
+        assert sorted(sweep) == [0, 3, 8]
+        assert sweep[0][0] == {}
+        assert sum(sweep[8][0].values()) == 8
+        assert residual_state(sweep[0][1]) == residual_state(R)
+        for budget in sweep:
+            dist, R_c = distribute(R, budget, te.get_guaranteed_edges, select)
+            assert sweep[budget][0] == dist
+            assert residual_state(sweep[budget][1]) == residual_state(R_c)
+
+def test_sweep_budget_no_levels():
+    assert ag.sweep_budget(small_residual(), [], te.get_guaranteed_edges, ag.get_highest_ev_edge) == {}
+
+def test_distribute_budget_journal_rollback():
+    R = small_residual()
+    before = residual_state(R)
+    journal = ag.UndoJournal(R)
+    dist, R_c = ag.distribute_budget(R, 5, te.get_guaranteed_edges, ag.get_highest_ev_edge, journal)
+    assert R_c is R and sum(dist.values()) == 5
+    assert dist == ag.distribute_budget(small_residual(), 5, te.get_guaranteed_edges, ag.get_highest_ev_edge)[0]
+    journal.rollback()
+    assert residual_state(R) == before
+
+def test_distribute_budget_journal_on_other_graph():
+    R = small_residual()
+    with pytest.raises(AssertionError):
+        ag.distribute_budget(R, 5, te.get_guaranteed_edges, ag.get_highest_ev_edge, ag.UndoJournal(R.copy()))
+
+def best_increase(G, sources, sinks, budget):
+    """Largest max flow increase over every way of spending budget on G's edges"""
+
+    H = G.copy()
+    H.add_edges_from(("source", s) for s in sources)
+    H.add_edges_from((t, "sink") for t in sinks)
+    base = nx.maximum_flow_value(H, "source", "sink")
+    best = 0
+    for split in itertools.combinations(range(budget + G.number_of_edges() - 1), G.number_of_edges() - 1):
+        # stars and bars, the gaps between the bars are the increases
+        increases = [b - a - 1 for a, b in zip((-1,) + split, split + (budget + G.number_of_edges() - 1,))]
+        for e, k in zip(G.edges, increases):
+            H.edges[e]["capacity"] = G.edges[e]["capacity"] + k
+        best = max(best, nx.maximum_flow_value(H, "source", "sink") - base)
+    return best
+
+def test_distribute_budget_exact_is_optimal():
+    G = nx.DiGraph()
+    # a flow increase on either path needs both of its edges upgraded
+    for u, v, capacity in [("a", "b", 1), ("b", "c", 1), ("a", "d", 2), ("d", "c", 2)]:
+        G.add_edge(u, v, capacity=capacity, slowing_prob=0.1, slowing_factor=0.5)
+    max_flow_val, R = md.get_intermediate_residual_graph(G, {"a"}, {"c"}, nx.flow.preflow_push)
+    for budget in range(6):
+        dist, R_c = ag.distribute_budget_exact(R, budget)
+        increase = sum(R_c["source"][v]["flow"] for v in R_c["source"]) - max_flow_val
+        assert sum(dist.values()) <= budget
+        assert increase == best_increase(G, {"a"}, {"c"}, budget)
+        # greedy never does better
+        _, R_g = ag.distribute_budget(R, budget, te.get_guaranteed_edges, ag.get_highest_ev_edge)
+        assert sum(R_g["source"][v]["flow"] for v in R_g["source"]) - max_flow_val <= increase
+
+def test_distribute_budget_exact_small_residual():
+    R = small_residual()
+    max_flow_val = sum(R["source"][v]["flow"] for v in R["source"])
+    G = nx.DiGraph([(u, v, {"capacity": R[u][v]["capacity"]}) for u, v in R.edges
+                    if u not in ("source", "sink") and v not in ("source", "sink") and R[u][v]["capacity"] > 0])
+    for budget in range(5):
+        _, R_c = ag.distribute_budget_exact(R, budget)
+        assert sum(R_c["source"][v]["flow"] for v in R_c["source"]) - max_flow_val == \
+            best_increase(G, {"a"}, {"e"}, budget)
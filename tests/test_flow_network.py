@@ -0,0 +1,54 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from flow_network import FlowNetwork
+from graphs import nx_max_flow_value, random_graph
+import numpy as np
+
+def random_capacities(network, k, seed):
+    rng = np.random.default_rng(seed)
+    return np.where(rng.random((k, len(network.edges))) < 0.3, network.capacity // 2, network.capacity)
+
+def test_max_flow_values_matches_networkx():
+    for seed in range(3):
+        G, sources, sinks = random_graph(seed)
+        network = FlowNetwork(G, sources, sinks)
+        capacities = random_capacities(network, 8, seed)
+        expected = [nx_max_flow_value(G, sources, sinks, row) for row in capacities]
+        assert network.max_flow_values(capacities).tolist() == expected
+
+def test_max_flow_values_no_scenarios():
+    G, sources, sinks = random_graph(0)
+    network = FlowNetwork(G, sources, sinks)
+    values = network.max_flow_values(np.zeros((0, len(network.edges)), dtype=np.int64))
+    assert values.shape == (0,)
+
+def test_max_flow_matches_networkx():
+    for seed in range(3):
+        G, sources, sinks = random_graph(seed)
+        network = FlowNetwork(G, sources, sinks)
+        value, flow = network.max_flow()
+        assert value == network.max_flow_value() == nx_max_flow_value(G, sources, sinks)
+        assert (flow >= 0).all() and (flow <= network.capacity).all()
+
+def test_repair_max_flow_value_matches_cold_solve():
+    for seed in range(3):
+        G, sources, sinks = random_graph(seed)
+        network = FlowNetwork(G, sources, sinks)
+        network.set_base()
+        for row in random_capacities(network, 8, seed):
+            cold = network.max_flow_value(row)
+            assert network.repair_max_flow_value(row) == cold
+            # always repaired, however much flow has to be rerouted
+            assert network.repair_max_flow_value(row, max_excess=float("inf")) == cold
+
+def test_repair_from_given_base_flow():
+    G, sources, sinks = random_graph(1)
+    network = FlowNetwork(G, sources, sinks)
+    _, flow = network.max_flow()
+    network.set_base(flow=flow)
+    assert network.base_value == nx_max_flow_value(G, sources, sinks)
+    for row in random_capacities(network, 8, 1):
+        assert network.repair_max_flow_value(row, max_excess=float("inf")) == network.max_flow_value(row)
@@ -0,0 +1,41 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from graphs import nx_max_flow_value, random_graph
+import max_flow_increase_bfs as mf
+import model as md
+import networkx as nx
+import random
+
+def bumped_residual(seed):
+    """Residual graph of a random graph with a max flow, then a few edges with more capacity"""
+
+    G, sources, sinks = random_graph(seed)
+    _, R = md.get_intermediate_residual_graph(G, sources, sinks, nx.flow.preflow_push)
+    rand = random.Random(seed)
+    for u, v in rand.sample(list(G.edges), 20):
+        k = rand.randint(1, 10)
+        G.edges[u, v]["capacity"] += k
+        R[u][v]["capacity"] += k
+    return G, sources, sinks, R
+
+def outflow(R):
+    return sum(R["source"][v]["flow"] for v in R["source"])
+
+def test_dinic_increase_matches_bfs():
+    for seed in range(3):
+        G, sources, sinks, R = bumped_residual(seed)
+        before = outflow(R)
+        R_bfs = R.copy()
+        increase = mf.apply_max_flow_increase_bfs(R_bfs, "source", "sink")
+        assert mf.apply_max_flow_increase_dinic(R, "source", "sink") == increase
+        assert outflow(R) == before + increase == nx_max_flow_value(G, sources, sinks)
+
+def test_dinic_increase_reports_changed_edges():
+    G, sources, sinks, R = bumped_residual(1)
+    flows = {e: R.edges[e]["flow"] for e in R.edges}
+    changed = []
+    mf.apply_max_flow_increase_dinic(R, "source", "sink", changed)
+    assert {e for e in R.edges if R.edges[e]["flow"] != flows[e]} <= set(changed)
@@ -0,0 +1,31 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from graphs import random_graph
+import max_flow_increase_bfs as mf
+import model as md
+import networkx as nx
+import random
+import target_edges as te
+
+def test_reachability_index_follows_augmentations():
+    for seed in range(3):
+        G, sources, sinks = random_graph(seed)
+        _, R = md.get_intermediate_residual_graph(G, sources, sinks, nx.flow.preflow_push)
+        index = te.ReachabilityIndex(R)
+        assert index.guaranteed_edges() == te.get_guaranteed_edges(R)
+        assert index.min_cut_edges() == te.get_min_cut_edges(R)
+
+        # one edge at a time, as distribute_budget does
+        rand = random.Random(seed)
+        for u, v in rand.sample(list(G.edges), 20):
+            R[u][v]["capacity"] += rand.randint(1, 10)
+            changed = [(u, v)]
+            mf.apply_max_flow_increase_dinic(R, "source", "sink", changed)
+            index.update(changed)
+            assert index.guaranteed_edges() == te.get_guaranteed_edges(R)
+            assert index.min_cut_edges() == te.get_min_cut_edges(R)
+            assert all(index.is_guaranteed(u, v) for u, v in te.get_guaranteed_edges(R))
+            assert all(index.is_min_cut(u, v) for u, v in te.get_min_cut_edges(R))